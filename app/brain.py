@@ -1,116 +1,190 @@
-import sqlite3
-from typing import Annotated
+from typing import Annotated, Optional
+from uuid import uuid4
 from typing_extensions import TypedDict
 from dotenv import load_dotenv
 
-from langgraph.graph import StateGraph, START
+from langgraph.graph import StateGraph, START, END
+from langgraph.constants import TAG_NOSTREAM
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 
-from app.fitbit_client import FitbitClient
-from app import database
+from app.fitbit_client import get_client
+from app import database, metrics, services, fitbit_sync, context_window, intent_router, food_index, media, response_cache
+from app.context_window import NO_NUDGE, SCHEDULER_PREFIX
+from app.tool_executor import make_tool_node
 
 load_dotenv()
 
-fitbit = FitbitClient()
+def user_id_for(config):
+    """Resolves the run's thread_id (the sender identity) to a users.id."""
+    return database.resolve_user_id(config["configurable"]["thread_id"])
+
+def health_status(user_id):
+    """Returns (target, eaten, burned, sleep minutes) for today. The two Fitbit reads run in parallel."""
+    target = database.get_calorie_target(user_id) or 2000
+    eaten = database.get_eaten_today(user_id)
+    fitbit = get_client(user_id).get_day_summary()
+    return target, eaten, fitbit["calories_burned"], fitbit["sleep_minutes"]
+
+def average_eaten(days, user_id):
+    avg = database.get_average_daily_intake(days, user_id)
+    return round(avg) if avg else 0
 
 @tool
-def reset_profile():
+def reset_profile(config: RunnableConfig):
     """Wipes the user's profile and food history clean. Use when they want to change goals or start over."""
-    conn = sqlite3.connect(database.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET weight = NULL, daily_calorie_target = NULL WHERE id = 1")
-    cursor.execute("DELETE FROM daily_logs WHERE user_id = 1") # Wipe food history
-    conn.commit()
-    conn.close()
+    database.reset_user(user_id_for(config)) # Wipes profile, food history and daily totals
     return "Profile and history successfully reset. Ready for onboarding."
 
 @tool
-def get_historical_summary(days: int):
+def get_historical_summary(days: int, config: RunnableConfig):
     """Fetches the average daily calories the user has eaten over the last X days."""
-    conn = sqlite3.connect(database.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f'''
-        SELECT AVG(daily_total) FROM (
-            SELECT SUM(calories_in) as daily_total
-            FROM daily_logs
-            WHERE user_id = 1 AND date >= date('now', '-{days} days')
-            GROUP BY date
-        )
-    ''')
-    row = cursor.fetchone()
-    conn.close()
-    
-    avg_eaten = round(row[0]) if row and row[0] else 0
+    avg_eaten = average_eaten(days, user_id_for(config))
     return f"Data context: Over the last {days} days, the user ate an average of {avg_eaten} kcal per day."
 
 @tool
-def get_health_status():
-    """Fetches user's daily calorie goal, logged food, and Fitbit calories burned."""
-    conn = sqlite3.connect(database.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS daily_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT, user_id INTEGER, food_name TEXT, calories_in INTEGER
-        )
-    ''')
-    cursor.execute("SELECT daily_calorie_target FROM users WHERE id = 1")
-    row = cursor.fetchone()
-    target = row[0] if row and row[0] else 2000
-    
-    cursor.execute("SELECT IFNULL(SUM(calories_in), 0) FROM daily_logs WHERE user_id = 1 AND date = date('now', 'localtime')")
-    eaten = cursor.fetchone()[0]
-    conn.close()
+def get_fitbit_history(days: int, config: RunnableConfig):
+    """Fetches the user's average Fitbit active calories burned, sleep and resting heart rate over the last X days."""
+    user_id = user_id_for(config)
+    fitbit_sync.sync_if_stale(get_client(user_id))
+    avg = fitbit_sync.get_daily_averages(days, user_id)
+    if not avg["days_with_data"]:
+        return f"Data context: No Fitbit data stored for the last {days} days."
+
+    def fmt(value, unit):
+        return f"{round(value)} {unit}" if value is not None else "n/a"
 
-    burned = fitbit.get_calories_today()
-    return f"Goal: {target} kcal. Eaten: {eaten} kcal. Burned (Fitbit): {burned} kcal."
+    return (
+        f"Data context: Over the last {days} days ({avg['days_with_data']} days with Fitbit data), "
+        f"the user burned an average of {fmt(avg['activity_calories'], 'active kcal')} per day, "
+        f"slept {fmt(avg['sleep_minutes'], 'min')} per night, "
+        f"resting heart rate {fmt(avg['resting_heart_rate'], 'bpm')}."
+    )
 
 @tool
-def log_food(food_name: str, calories: int):
-    """Logs food eaten by the user."""
-    conn = sqlite3.connect(database.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS daily_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT, user_id INTEGER, food_name TEXT, calories_in INTEGER
-        )
-    ''')
-    cursor.execute("INSERT INTO daily_logs (date, user_id, food_name, calories_in) VALUES (date('now', 'localtime'), 1, ?, ?)", (food_name, calories))
-    conn.commit()
-    conn.close()
+def get_health_status(config: RunnableConfig):
+    """Fetches user's daily calorie goal, logged food, Fitbit calories burned and last night's sleep."""
+    target, eaten, burned, sleep = health_status(user_id_for(config))
+    return f"Goal: {target} kcal. Eaten: {eaten} kcal. Burned (Fitbit): {burned} kcal. Slept (Fitbit): {sleep} min."
+
+@tool
+def lookup_food_calories(food_name: str, config: RunnableConfig):
+    """Looks up calories per serving for a food from the user's past logs and the nutrition table. Use when the user asks what a food costs, not before logging."""
+    found = food_index.lookup(food_name, user_id_for(config))
+    if not found:
+        return f"No stored calories for '{food_name}'. Estimate them yourself."
+    logged = f", logged {found['times_logged']} times" if found["times_logged"] else ""
+    return f"Known food: {found['name']} ≈ {found['calories']} kcal per serving (from {found['source']}{logged})."
+
+@tool
+def log_food(food_name: str, config: RunnableConfig, calories: Optional[int] = None, servings: float = 1.0):
+    """Logs food eaten by the user. Leave calories out to use the stored calories per serving times servings; give them when the user states them or no value is stored."""
+    user_id = user_id_for(config)
+    if calories is None:
+        found = food_index.lookup(food_name, user_id)
+        if not found:
+            return f"Not logged: no stored calories for '{food_name}'. Estimate them and call log_food again with calories."
+        calories = round(found["calories"] * servings)
+    database.add_food_log(food_name, calories, user_id)
     return f"Successfully logged {food_name} ({calories} kcal)."
 
 @tool
-def update_profile(weight: float, target_calories: int):
+def update_profile(weight: float, target_calories: int, config: RunnableConfig):
     """Updates the user's weight and daily calorie target."""
-    conn = sqlite3.connect(database.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET weight = ?, daily_calorie_target = ? WHERE id = 1", (weight, target_calories))
-    conn.commit()
-    conn.close()
+    database.update_profile(weight, target_calories, user_id_for(config))
     return f"Profile updated. Weight: {weight}kg, Goal: {target_calories} kcal."
 
+def message_text(message):
+    """Extracts the plain text from an AI message (Gemini may return a list of content blocks)."""
+    if isinstance(message.content, str):
+        return message.content
+    return "\n".join(
+        block["text"] for block in message.content
+        if isinstance(block, dict) and "text" in block
+    )
+
 class State(TypedDict):
     messages: Annotated[list, add_messages]
 
-tools = [get_health_status, log_food, update_profile, reset_profile, get_historical_summary]
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
-llm_with_tools = llm.bind_tools(tools)
+tools = [get_health_status, log_food, update_profile, reset_profile, get_historical_summary, get_fitbit_history, lookup_food_calories]
+# Safe to run concurrently and memoize within a turn; everything else is a write.
+read_only_tools = {get_health_status.name, get_historical_summary.name, get_fitbit_history.name, lookup_food_calories.name}
+# Bump whenever the coaching prompt changes, so cached meal plans from the old prompt are never served.
+PROMPT_VERSION = 3
 
-def chatbot(state: State):
-    conn = sqlite3.connect(database.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT daily_calorie_target FROM users WHERE id = 1")
-    row = cursor.fetchone()
-    conn.close()
-    
-    target = row[0] if row else None
+def summarize_history(previous_summary, transcript):
+    """Folds turns that left the context window into the thread's rolling summary."""
+    with metrics.LLM_SECONDS.timer("summary"):
+        response = services.llm().invoke([
+            SystemMessage(content=(
+                "Update the running summary of a conversation between a user and their nutrition coach. "
+                "Keep facts that matter later: goals, body stats, foods eaten, preferences, advice given. "
+                "Reply with the updated summary only, under 150 words."
+            )),
+            HumanMessage(content=f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"),
+        ], config={"tags": [TAG_NOSTREAM]})  # keep the summary out of stream_mode="messages"
+    return message_text(response)
+
+def _fast_path_reply(intent, args, user_id):
+    """Runs the tool behind a recognised intent. Returns (tool, args, tool_output, reply)."""
+    if intent == "status":
+        target, eaten, burned, sleep = health_status(user_id)
+        output = f"Goal: {target} kcal. Eaten: {eaten} kcal. Burned (Fitbit): {burned} kcal. Slept (Fitbit): {sleep} min."
+        remaining = target + burned - eaten
+        reply = (
+            f"📊 Today so far:\n• Goal: {target} kcal\n• Eaten: {eaten} kcal\n• Burned (Fitbit): {burned} kcal\n"
+            f"• Slept (Fitbit): {sleep} min\n"
+            + (f"You have {remaining} kcal left for today. 💪" if remaining >= 0
+               else f"You're {-remaining} kcal over for today. A lighter next meal will balance it out.")
+        )
+        return get_health_status, args, output, reply
+    if intent == "history":
+        days = args["days"]
+        avg_eaten = average_eaten(days, user_id)
+        output = f"Data context: Over the last {days} days, the user ate an average of {avg_eaten} kcal per day."
+        target = database.get_calorie_target(user_id)
+        reply = f"📈 Over the last {days} days you ate an average of {avg_eaten} kcal per day"
+        reply += f" (goal: {target} kcal)." if target else "."
+        return get_historical_summary, args, output, reply
+    database.reset_user(user_id)
+    output = "Profile and history successfully reset. Ready for onboarding."
+    reply = "🔄 Done! Your profile and food history are cleared. Tell me your current weight and daily calorie goal to start fresh."
+    return reset_profile, args, output, reply
+
+def router(state: State, config: RunnableConfig):
+    """
+    Fast path: answers status/history/reset requests from a template without
+    calling Gemini. The turn is written as a normal tool call + reply so the
+    history looks the same to the LLM on later turns.
+    """
+    last = state["messages"][-1]
+    if last.type != "human" or not isinstance(last.content, str) or last.content.startswith(SCHEDULER_PREFIX):
+        return {}
+
+    user_id = user_id_for(config)
+    match = intent_router.match_intent(last.content)
+    if match and match[0] != "reset" and not database.get_calorie_target(user_id):
+        match = None  # not onboarded yet: let the LLM run onboarding
+    intent_router.record(match[0] if match else None)
+    if not match:
+        return {}
+
+    intent, args = match
+    fast_tool, args, output, reply = _fast_path_reply(intent, args, user_id)
+    call_id = f"fastpath_{uuid4().hex[:12]}"
+    return {"messages": [
+        AIMessage(content="", tool_calls=[{"name": fast_tool.name, "args": args, "id": call_id}]),
+        ToolMessage(content=output, name=fast_tool.name, tool_call_id=call_id),
+        AIMessage(content=reply),
+    ]}
+
+def route_after_router(state: State):
+    return "chatbot" if state["messages"][-1].type == "human" else END
+
+def chatbot(state: State, config: RunnableConfig):
+    target = database.get_calorie_target(user_id_for(config))
 
     # STATE A: ONBOARDING MODE
     if not target:
@@ -122,7 +196,8 @@ def chatbot(state: State):
             "3. If they provide those stats, CALCULATE their required daily calorie target yourself using standard BMR/TDEE formulas to meet their timeline goal.\n"
             "4. Briefly explain your math to the user (e.g., 'To gain 5kg in 3 months, you need a surplus of X calories...').\n"
             "5. Immediately use the `update_profile` tool to save their weight, height and the calculated calorie target.\n"
-            "6. DO NOT log food or check Fitbit until the profile is saved."
+            "6. DO NOT log food or check Fitbit until the profile is saved.\n"
+            f"7. SCHEDULER: A message starting with {SCHEDULER_PREFIX} is a background check, not the user. Reply with exactly {NO_NUDGE}."
         ))
     
     # STATE B: ACTIVE COACHING MODE
@@ -132,24 +207,64 @@ def chatbot(state: State):
             "RULES:\n"
             "1. MEAL PLANNING: If the user asks for a diet plan or what to eat, SUGGEST specific, tasty meals (Indian or Global) that fit their daily calorie goal. Do NOT tell them to see a doctor for a basic meal plan.\n"
             "2. STRICT LOGGING RULE: DO NOT use the `log_food` tool when you are just suggesting or planning meals.\n"
-            "3. TRACKING FOOD: ONLY use the `log_food` tool when the user explicitly confirms they ACTUALLY ATE the food (e.g., 'I had oats for breakfast', 'I ate the lunch you suggested'). Estimate the calories yourself.\n"
+            "3. TRACKING FOOD: ONLY use the `log_food` tool when the user explicitly confirms they ACTUALLY ATE the food (e.g., 'I had oats for breakfast', 'I ate the lunch you suggested'). Call it right away, one call per food (in parallel if several), without `calories` and with `servings` for the portion: the stored value is used. Pass `calories` only when the user states them, or when the tool says no value is stored.\n"
             "4. STATUS: Use `get_health_status` to check their remaining calories for today.\n"
-            "5. HISTORY: If they ask about past days or average performance, use `get_historical_summary`.\n"
+            "5. HISTORY: If they ask about past days or average performance, use `get_historical_summary`. For past calories burned, sleep or heart rate, use `get_fitbit_history`.\n"
             "6. RESET: If they want to start over, use `reset_profile`.\n"
+            f"7. SCHEDULER: A message starting with {SCHEDULER_PREFIX} is a background check, not the user; your reply is sent to their phone unprompted. "
+            "Use `get_health_status` and send ONE short nudge only when it clearly helps (e.g. a meal not logged by its usual time, or far over/under the goal late in the day). "
+            f"Don't repeat a nudge you already sent today. Otherwise reply with exactly {NO_NUDGE} and nothing else.\n"
             "Be encouraging, concise, and calculate remaining calories accurately: (Goal + Fitbit Burned) - Eaten."
         ))
     
-    messages_to_pass = [system_prompt] + state["messages"]
-    response = llm_with_tools.invoke(messages_to_pass)
+    # Opt-in cache for pure meal-planning questions (never for turns that call tools).
+    # Checked before the context window is built: that may cost a summarize call.
+    last = state["messages"][-1]
+    cacheable = (
+        response_cache.ENABLED and target and last.type == "human"
+        and isinstance(last.content, str) and response_cache.is_planning_request(last.content)
+    )
+    if cacheable:
+        cached = response_cache.cache.get(last.content, target, PROMPT_VERSION)
+        if cached:
+            return {"messages": [AIMessage(content=cached)]}
+
+    summary, window = context_window.build_window(
+        config["configurable"]["thread_id"], state["messages"], summarize_history
+    )
+    if summary:
+        system_prompt = SystemMessage(content=f"{system_prompt.content}\n\nEARLIER CONVERSATION (summary):\n{summary}")
+
+    messages_to_pass = [system_prompt] + [media.inline_images(message) for message in window]
+    with metrics.LLM_SECONDS.timer("chatbot"):
+        response = services.llm_with_tools().invoke(messages_to_pass)
+    if cacheable and not response.tool_calls and message_text(response):
+        response_cache.cache.put(last.content, target, PROMPT_VERSION, message_text(response))
     return {"messages": [response]}
 
-graph_builder = StateGraph(State)
-graph_builder.add_node("chatbot", chatbot)
-graph_builder.add_node("tools", ToolNode(tools=tools))
-graph_builder.add_edge(START, "chatbot")
-graph_builder.add_conditional_edges("chatbot", tools_condition)
-graph_builder.add_edge("tools", "chatbot")
+def _instrumented(name, node):
+    """Wraps a node so every run is timed (nutriagent_node_seconds) and traced."""
+    def run(state: State, config: RunnableConfig):
+        with metrics.span(f"node {name}"), metrics.NODE_SECONDS.timer(name):
+            return node(state, config)
+    return run
+
+def build_graph():
+    """Returns the uncompiled StateGraph; services.graph() compiles and shares it."""
+    from langgraph.prebuilt import tools_condition
+
+    graph_builder = StateGraph(State)
+    graph_builder.add_node("router", _instrumented("router", router))
+    graph_builder.add_node("chatbot", _instrumented("chatbot", chatbot))
+    graph_builder.add_node("tools", _instrumented("tools", make_tool_node(tools, read_only_tools)))
+    graph_builder.add_edge(START, "router")
+    graph_builder.add_conditional_edges("router", route_after_router, ["chatbot", END])
+    graph_builder.add_conditional_edges("chatbot", tools_condition)
+    graph_builder.add_edge("tools", "chatbot")
+    return graph_builder
 
-conn = sqlite3.connect(database.DB_PATH, check_same_thread=False)
-memory = SqliteSaver(conn)
-app_graph = graph_builder.compile(checkpointer=memory)
\ No newline at end of file
+def __getattr__(name):
+    # `from app.brain import app_graph` keeps working, but builds lazily.
+    if name == "app_graph":
+        return services.graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""
+Retention for the LangGraph SqliteSaver tables in nutriagent.db.
+
+Every turn (and every scheduler tick) appends checkpoints; nothing ever
+deletes them. Each checkpoint carries the full channel state, so only the
+newest few per thread are needed to resume a conversation. This keeps the
+latest KEEP_CHECKPOINTS per thread, drops orphaned pending writes, and
+returns the freed pages to the OS with incremental vacuum.
+
+Incremental vacuum needs auto_vacuum=INCREMENTAL, which an existing file
+only gets from a full VACUUM. That rewrite holds an exclusive lock on the
+whole database, so it is never done by the background job: run
+`python -m app.checkpoint_retention convert` once, during a maintenance
+window. Until then freed pages are reused but the file doesn't shrink.
+
+Usage: python -m app.checkpoint_retention [keep]
+       python -m app.checkpoint_retention convert
+"""
+import os
+import sys
+import time
+import threading
+
+from app import database
+
+KEEP_CHECKPOINTS = int(os.getenv("CHECKPOINT_KEEP", 20))
+BATCH_SIZE = int(os.getenv("CHECKPOINT_PRUNE_BATCH", 1000))
+PRUNE_INTERVAL = int(os.getenv("CHECKPOINT_PRUNE_INTERVAL", 6 * 3600))
+LATENCY_SAMPLE = 50  # threads timed for the before/after load latency
+
+
+def _tables_exist(conn):
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return {"checkpoints", "writes"} <= names
+
+
+def _db_size(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return pages * page_size, free * page_size
+
+
+def _load_latency(conn, threads):
+    """Average seconds to load the latest checkpoint + its writes, the same reads SqliteSaver.get_tuple does."""
+    if not threads:
+        return 0.0
+    start = time.perf_counter()
+    for thread_id, ns in threads:
+        row = conn.execute(
+            "SELECT checkpoint_id, checkpoint, metadata FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+            (thread_id, ns),
+        ).fetchone()
+        if row:
+            conn.execute(
+                "SELECT task_id, channel, type, value FROM writes "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+                (thread_id, ns, row[0]),
+            ).fetchall()
+    return (time.perf_counter() - start) / len(threads)
+
+
+def _batched(conn, step):
+    """
+    Calls step(budget) -> units of work done (None once finished) inside
+    short write transactions of about BATCH_SIZE units each.
+    """
+    done = False
+    while not done:
+        budget = BATCH_SIZE
+        database._with_retry(lambda: conn.execute("BEGIN IMMEDIATE"))
+        try:
+            while budget > 0:
+                work = step(budget)
+                if work is None:
+                    done = True
+                    break
+                budget -= work
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _prune_checkpoints(conn, keep):
+    """
+    Deletes all but the newest `keep` checkpoints (and their writes) per
+    thread. The per-thread cutoff is computed in one pass up front; the
+    deletes are then primary-key range scans below each cutoff.
+    """
+    pending = conn.execute("""
+        SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+            SELECT thread_id, checkpoint_ns, checkpoint_id, ROW_NUMBER() OVER (
+                PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+            ) AS rn FROM checkpoints
+        ) WHERE rn = ?
+    """, (keep,)).fetchall()
+    counts = {"checkpoints": 0, "writes": 0}
+
+    def step(budget):
+        if not pending:
+            return None
+        thread_id, ns, cutoff = pending[-1]
+        deleted = 0
+        for table in ("writes", "checkpoints"):
+            n = conn.execute(f"""
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table}
+                    WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ? LIMIT ?
+                )
+            """, (thread_id, ns, cutoff, budget - deleted)).rowcount
+            counts[table] += n
+            deleted += n
+            if deleted >= budget:
+                return deleted  # this thread may have more; come back to it
+        pending.pop()
+        return max(deleted, 1)
+
+    _batched(conn, step)
+    return counts
+
+
+def _prune_orphan_writes(conn):
+    """Deletes writes whose checkpoint no longer exists, walking the table once in rowid windows."""
+    last = conn.execute("SELECT MAX(rowid) FROM writes").fetchone()[0] or 0
+    cursor = [0]
+    deleted = [0]
+
+    def step(budget):
+        if cursor[0] >= last:
+            return None
+        low, high = cursor[0], cursor[0] + budget
+        cursor[0] = high
+        deleted[0] += conn.execute("""
+            DELETE FROM writes WHERE rowid IN (
+                SELECT w.rowid FROM writes w
+                LEFT JOIN checkpoints c ON c.thread_id = w.thread_id
+                    AND c.checkpoint_ns = w.checkpoint_ns AND c.checkpoint_id = w.checkpoint_id
+                WHERE w.rowid > ? AND w.rowid <= ? AND c.checkpoint_id IS NULL
+            )
+        """, (low, high)).rowcount
+        return budget  # rowids scanned
+
+    _batched(conn, step)
+    return deleted[0]
+
+
+def _vacuum(conn):
+    """Incremental vacuum if the file supports it (see convert()); never a full VACUUM."""
+    vacuumed = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    if vacuumed:
+        # executescript steps the pragma to completion; a plain execute()
+        # only frees a single page per step.
+        conn.executescript("PRAGMA incremental_vacuum")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return vacuumed
+
+
+def convert():
+    """
+    One-time switch to auto_vacuum=INCREMENTAL. Runs a full VACUUM, which
+    locks the whole database until it finishes: stop the app first.
+    """
+    conn = database.connect(isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def prune(keep=KEEP_CHECKPOINTS):
+    """Runs one retention pass and returns a report dict."""
+    conn = database.connect(isolation_level=None, check_same_thread=False)
+    try:
+        if not _tables_exist(conn):
+            return {"skipped": "no checkpoint tables"}
+
+        threads = conn.execute(
+            "SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints LIMIT ?", (LATENCY_SAMPLE,)
+        ).fetchall()
+        size_before, _ = _db_size(conn)
+        latency_before = _load_latency(conn, threads)
+
+        counts = _prune_checkpoints(conn, keep)
+        orphans = _prune_orphan_writes(conn)
+
+        vacuumed = _vacuum(conn)
+        size_after, _ = _db_size(conn)
+        latency_after = _load_latency(conn, threads)
+    finally:
+        conn.close()
+
+    return {
+        "checkpoints_deleted": counts["checkpoints"],
+        "writes_deleted": counts["writes"] + orphans,
+        "incremental_vacuum": vacuumed,
+        "bytes_before": size_before,
+        "bytes_after": size_after,
+        "bytes_reclaimed": size_before - size_after,
+        "load_ms_before": round(latency_before * 1000, 3),
+        "load_ms_after": round(latency_after * 1000, 3),
+    }
+
+
+def start_background_job(interval=PRUNE_INTERVAL, keep=KEEP_CHECKPOINTS, jobs=()):
+    """
+    Runs prune() every `interval` seconds on a daemon thread, followed by
+    `jobs`: other housekeeping callables returning something to log.
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            for name, job in [("checkpoints", lambda: prune(keep)), *((job.__qualname__, job) for job in jobs)]:
+                try:
+                    print(f"[Retention] {name}: {job()}")
+                except Exception as e:
+                    print(f"[Retention] {name} error: {e}")
+
+    thread = threading.Thread(target=loop, name="checkpoint-retention", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "convert":
+        print("Converted to auto_vacuum=INCREMENTAL." if convert() else "Already auto_vacuum=INCREMENTAL.")
+        sys.exit(0)
+    keep = int(sys.argv[1]) if len(sys.argv) > 1 else KEEP_CHECKPOINTS
+    for key, value in prune(keep).items():
+        print(f"{key:20} {value}")
@@ -0,0 +1,198 @@
+"""
+Keeps the prompt the chatbot node sends to Gemini under a token budget.
+
+The thread history is split into turns (a human message and everything the
+agent did in response). The current turn is always sent verbatim. Older
+turns are compacted (tool calls/results and scheduler checks that sent
+nothing dropped, photos replaced by a placeholder, only the user's words
+and the final reply kept) and included newest-first while
+they fit the budget. Whatever falls off the end is folded into a rolling
+summary, only recomputed when the boundary moves. Summaries are stored in
+the thread_summaries table (with a bounded in-process cache), so they
+survive restarts, and each summarize call sees at most
+SUMMARY_MAX_TOKENS of transcript. Turns before the latest profile reset
+(a RESET_TOOL result in the thread) are neither sent nor summarized.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app import database
+
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+# When the boundary has to move, move it this many extra turns so the
+# summary isn't recomputed on every single message.
+SUMMARY_STEP = int(os.getenv("CONTEXT_SUMMARY_STEP", 4))
+# Cap on the transcript handed to one summarize call; older text beyond it is dropped.
+SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", 4000))
+CACHE_SIZE = int(os.getenv("CONTEXT_SUMMARY_CACHE", 1024))  # threads whose summary is kept in memory
+IMAGE_TOKENS = 258  # Gemini's flat cost for an image part
+IMAGE_PARTS = ("image_url", "image_ref")  # inline images and app.media references
+SCHEDULER_PREFIX = "SCHEDULER_TRIGGER"
+RESET_TOOL = "reset_profile"
+NO_NUDGE = "NO_NUDGE"  # a scheduler turn's reply when there is nothing worth sending
+
+_lock = threading.Lock()
+_summaries = OrderedDict()  # thread_id -> (turns_covered, summary_text), least recently used first
+_metrics = {"turns": 0, "tokens_in": 0, "tokens_sent": 0, "summaries": 0}
+
+
+def _text(message):
+    if isinstance(message.content, str):
+        return message.content
+    return " ".join(
+        block.get("text", "") for block in message.content if isinstance(block, dict)
+    )
+
+
+def estimate_tokens(message):
+    """Rough count (~4 chars per token), which is all a budget needs."""
+    tokens = 4 + len(_text(message)) // 4
+    if isinstance(message.content, list):
+        tokens += IMAGE_TOKENS * sum(
+            1 for block in message.content if isinstance(block, dict) and block.get("type") in IMAGE_PARTS
+        )
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += len(str(call.get("args", ""))) // 4 + 8
+    return tokens
+
+
+def split_turns(messages):
+    turns = []
+    for message in messages:
+        if message.type == "human" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def compact_turn(turn):
+    """
+    Older turns: keep what the user said and the final reply, drop tool
+    traffic. A photo becomes a placeholder (the reply already describes it).
+    Scheduler checks are kept only if they sent a nudge (the user may be
+    answering it).
+    """
+    first = turn[0]
+    replies = [m for m in turn if m.type == "ai" and not m.tool_calls and _text(m)]
+    if first.type == "human" and _text(first).startswith(SCHEDULER_PREFIX):
+        if not replies or NO_NUDGE in _text(replies[-1]):
+            return []
+    if first.type == "human" and not isinstance(first.content, str):
+        first = HumanMessage(content=f"{_text(first).strip()} [food photo]".strip())
+    kept = [first] if first.type == "human" else []
+    if replies:
+        kept.append(AIMessage(content=_text(replies[-1])))
+    return kept
+
+
+def _last_reset(turns):
+    """Index of the newest turn that reset the profile, 0 if there is none."""
+    for index in range(len(turns) - 1, 0, -1):
+        if any(m.type == "tool" and getattr(m, "name", None) == RESET_TOOL and getattr(m, "status", None) != "error"
+               for m in turns[index]):
+            return index
+    return 0
+
+
+def _render(turns, max_tokens=SUMMARY_MAX_TOKENS):
+    """Transcript of compacted turns, keeping only the newest ~max_tokens of it."""
+    lines = []
+    for turn in turns:
+        for message in compact_turn(turn):
+            speaker = "User" if message.type == "human" else "Coach"
+            lines.append(f"{speaker}: {_text(message)}")
+    transcript = "\n".join(lines)
+    if len(transcript) > max_tokens * 4:
+        transcript = "(earlier turns omitted)\n..." + transcript[-max_tokens * 4:]
+    return transcript
+
+
+def _remember(thread_id, entry):
+    with _lock:
+        _summaries[thread_id] = entry
+        _summaries.move_to_end(thread_id)
+        while len(_summaries) > CACHE_SIZE:
+            _summaries.popitem(last=False)
+
+
+def _load(thread_id):
+    """Returns (turns_covered, summary) from the cache, falling back to SQLite."""
+    with _lock:
+        entry = _summaries.get(thread_id)
+        if entry is not None:
+            _summaries.move_to_end(thread_id)
+            return entry
+    row = database.query_one("SELECT turns_covered, summary FROM thread_summaries WHERE thread_id = ?", (thread_id,))
+    entry = (row[0], row[1]) if row else (0, "")
+    _remember(thread_id, entry)
+    return entry
+
+
+def _save(thread_id, entry):
+    database.execute("""
+        INSERT INTO thread_summaries (thread_id, turns_covered, summary, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(thread_id) DO UPDATE SET turns_covered = excluded.turns_covered,
+            summary = excluded.summary, updated_at = excluded.updated_at
+    """, (thread_id, *entry, time.time()))
+    _remember(thread_id, entry)
+
+
+def build_window(thread_id, messages, summarize, budget=TOKEN_BUDGET):
+    """
+    Returns (summary, window_messages). `summarize(previous_summary, transcript)`
+    is only called when turns newly fall outside the window.
+    """
+    turns = split_turns(messages)
+    tokens_in = sum(estimate_tokens(m) for m in messages)
+    floor = _last_reset(turns)
+
+    # Walk back from the newest turn until the budget is spent; `boundary`
+    # ends up as the oldest turn that still fits.
+    current = turns[-1] if turns else []
+    used = sum(estimate_tokens(m) for m in current)
+    boundary = max(len(turns) - 1, 0)
+    for index in range(len(turns) - 2, floor - 1, -1):
+        used += sum(estimate_tokens(m) for m in compact_turn(turns[index]))
+        if used > budget:
+            break
+        boundary = index
+
+    covered, summary = _load(thread_id)
+    if covered > len(turns) - 1:
+        covered, summary = 0, ""  # the thread's history was replaced since this summary was made
+    if covered < floor or (covered == floor and summary):
+        # The profile was reset since this summary was made (one ending at the
+        # reset covers only older turns): drop it and the old history without an LLM call.
+        covered, summary = floor, ""
+        _save(thread_id, (covered, summary))
+    if boundary > covered:
+        # Some turns fell out of the window: fold them (plus a little slack) into the summary.
+        new_covered = min(boundary + SUMMARY_STEP, len(turns) - 1)
+        summary = summarize(summary, _render(turns[covered:new_covered]))
+        covered = new_covered
+        _save(thread_id, (covered, summary))
+        with _lock:
+            _metrics["summaries"] += 1
+
+    # Turns already summarized are never resent verbatim.
+    window = []
+    for index in range(covered, len(turns) - 1):
+        window.extend(compact_turn(turns[index]))
+    window.extend(current)
+
+    tokens_sent = sum(estimate_tokens(m) for m in window) + len(summary) // 4
+    with _lock:
+        _metrics["turns"] += 1
+        _metrics["tokens_in"] += tokens_in
+        _metrics["tokens_sent"] += tokens_sent
+    print(f"[Context] {thread_id}: {tokens_in} -> {tokens_sent} tokens ({tokens_in - tokens_sent} saved)")
+    return summary, window
+
+
+def stats():
+    with _lock:
+        return dict(_metrics, tokens_saved=_metrics["tokens_in"] - _metrics["tokens_sent"])
@@ -1,46 +1,572 @@
 import sqlite3
 import os
+import re
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+from app import metrics
+
+DB_PATH = os.getenv("NUTRIAGENT_DB", "nutriagent.db")
+
+# Tuning for a small, write-light / read-heavy workload shared by the
+# webhook, the scheduler and the LangGraph checkpointer.
+BUSY_TIMEOUT_MS = 5000
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.05  # seconds, doubled on every retry
+STATEMENT_CACHE_SIZE = 256
+# A write that waits longer than this for the lock is counted as a lock wait.
+LOCK_WAIT_THRESHOLD = 0.002  # seconds
+USER_CACHE_SIZE = 65536
+# Only senders on this channel get scheduled nudges and outbound messages;
+# the local Streamlit user ("1") and other test threads never do.
+WHATSAPP_PREFIX = "whatsapp:"
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",  # ~8 MB page cache
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+)
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_lock_stats = {"writes": 0, "lock_waits": 0, "lock_wait_seconds": 0.0, "lock_retries": 0}
+
+
+def connect(path=None, **kwargs):
+    """Opens a new connection with WAL journaling and the tuned pragmas applied."""
+    kwargs.setdefault("timeout", BUSY_TIMEOUT_MS / 1000)
+    kwargs.setdefault("cached_statements", STATEMENT_CACHE_SIZE)
+    conn = sqlite3.connect(path or DB_PATH, **kwargs)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """
+    Returns this thread's shared connection, opening it on first use.
+    Connections run in autocommit mode; use `transaction()` to group writes.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = connect(isolation_level=None)
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+
+def close_connection():
+    """Closes this thread's connection (e.g. at worker shutdown)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def _is_lock_error(exc):
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def _with_retry(fn):
+    """Runs fn(), retrying with exponential backoff while the DB is locked."""
+    delay = LOCK_BACKOFF
+    for attempt in range(LOCK_RETRIES + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not _is_lock_error(e) or attempt == LOCK_RETRIES:
+                raise
+            with _stats_lock:
+                _lock_stats["lock_retries"] += 1
+            time.sleep(delay)
+            delay *= 2
+
+
+def _timed_write(fn, op="write"):
+    """_with_retry for statements that take the write lock; slow acquisitions are counted as lock waits."""
+    start = time.perf_counter()
+    result = _with_retry(fn)
+    waited = time.perf_counter() - start
+    metrics.SQLITE_SECONDS.observe(waited, op)
+    with _stats_lock:
+        _lock_stats["writes"] += 1
+        if waited > LOCK_WAIT_THRESHOLD:
+            _lock_stats["lock_waits"] += 1
+            _lock_stats["lock_wait_seconds"] += waited
+    return result
+
+
+def lock_stats():
+    """Write-lock contention counters since process start (busy_timeout waits included)."""
+    with _stats_lock:
+        result = dict(_lock_stats)
+    result["lock_wait_seconds"] = round(result["lock_wait_seconds"], 3)
+    return result
+
+
+def execute(sql, params=()):
+    """Runs a single write statement and returns the cursor."""
+    conn = get_connection()
+    return _timed_write(lambda: conn.execute(sql, params))
+
+
+def executemany(sql, seq_of_params):
+    conn = get_connection()
+    with metrics.SQLITE_SECONDS.timer("write_many"):
+        return _with_retry(lambda: conn.executemany(sql, seq_of_params))
+
+
+def query_one(sql, params=()):
+    conn = get_connection()
+    start = time.perf_counter()
+    row = _with_retry(lambda: conn.execute(sql, params).fetchone())
+    metrics.SQLITE_SECONDS.observe(time.perf_counter() - start, "read")
+    return row
+
+
+def query_all(sql, params=()):
+    conn = get_connection()
+    start = time.perf_counter()
+    rows = _with_retry(lambda: conn.execute(sql, params).fetchall())
+    metrics.SQLITE_SECONDS.observe(time.perf_counter() - start, "read")
+    return rows
+
+
+@contextmanager
+def transaction():
+    """
+    Groups several statements into one write transaction.
+    BEGIN IMMEDIATE takes the write lock up front, so the statements inside
+    never hit SQLITE_BUSY half way through.
+    """
+    conn = get_connection()
+    _timed_write(lambda: conn.execute("BEGIN IMMEDIATE"), op="begin")
+    start = time.perf_counter()
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+    finally:
+        metrics.SQLITE_SECONDS.observe(time.perf_counter() - start, "transaction")
+
+
+def _fix_weight_column(conn):
+    """Early databases were created with a capitalised `Weight` column."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    if "Weight" in columns:
+        conn.execute("ALTER TABLE users RENAME COLUMN Weight TO weight")
+
+
+# Append-only: each entry is (version, steps). A step is either a SQL
+# string or a callable taking the connection. Never edit a shipped entry.
+MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS users(
+        id INTEGER PRIMARY KEY,
+        access_token TEXT,
+        refresh_token TEXT,
+        expires_at REAL,
+        height REAL,
+        weight REAL,
+        goal TEXT,
+        daily_calorie_target INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT, user_id INTEGER, food_name TEXT, calories_in INTEGER
+        )
+        """,
+        "INSERT OR IGNORE INTO users (id) VALUES (1)",
+    ]),
+    (2, [
+        _fix_weight_column,
+        # Covers "today's total" and the date-range history scans.
+        "CREATE INDEX IF NOT EXISTS idx_daily_logs_user_date ON daily_logs(user_id, date)",
+    ]),
+    (3, [
+        # One row per user per day, kept in step with daily_logs by the
+        # write helpers below so history reads never aggregate raw rows.
+        """
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            calories_in INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, date)
+        ) WITHOUT ROWID
+        """,
+        lambda conn: _rebuild_daily_totals(conn),
+    ]),
+    (4, [
+        # Local copy of Fitbit daily series, filled by app.fitbit_sync.
+        """
+        CREATE TABLE IF NOT EXISTS fitbit_daily (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            activity_calories INTEGER,
+            sleep_minutes INTEGER,
+            resting_heart_rate INTEGER,
+            PRIMARY KEY (user_id, date)
+        ) WITHOUT ROWID
+        """,
+        # High-water mark per user and series: last date fully synced.
+        """
+        CREATE TABLE IF NOT EXISTS fitbit_sync_state (
+            user_id INTEGER NOT NULL,
+            resource TEXT NOT NULL,
+            synced_through TEXT,
+            synced_at REAL,
+            PRIMARY KEY (user_id, resource)
+        )
+        """,
+    ]),
+    (5, [
+        # Twilio MessageSid dedup for webhook retries (see app/dedup.py).
+        """
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            message_sid TEXT PRIMARY KEY,
+            sender TEXT,
+            received_at REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            response TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_processed_messages_received ON processed_messages(received_at)",
+    ]),
+    (6, [
+        # Users are keyed by sender identity (the graph's thread_id, e.g.
+        # "whatsapp:+91..."). The original single user keeps id 1 and is
+        # reachable as thread "1", which the Streamlit UI uses.
+        "ALTER TABLE users ADD COLUMN sender TEXT",
+        "ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1",
+        "UPDATE users SET sender = '1' WHERE id = 1 AND sender IS NULL",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_sender ON users(sender)",
+        "CREATE INDEX IF NOT EXISTS idx_users_active ON users(active, id)",
+    ]),
+    (7, [
+        # Per-user next check time for scheduler.py, so restarts resume cleanly.
+        """
+        CREATE TABLE IF NOT EXISTS scheduler_state (
+            user_id INTEGER PRIMARY KEY,
+            next_run REAL NOT NULL,
+            last_run REAL,
+            last_status TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scheduler_state_next_run ON scheduler_state(next_run)",
+    ]),
+    (8, [
+        # Last state snapshot the scheduler showed the LLM (see app/nudge_gate.py).
+        """
+        CREATE TABLE IF NOT EXISTS nudge_state (
+            user_id INTEGER PRIMARY KEY,
+            goal INTEGER,
+            eaten INTEGER,
+            burned INTEGER,
+            bucket INTEGER,
+            last_nudge_at REAL
+        )
+        """,
+    ]),
+    (9, [
+        # Per-user calorie memory built from logged foods (user_id 0 holds the
+        # optional bundled nutrition table). See app/food_index.py.
+        """
+        CREATE TABLE IF NOT EXISTS food_index (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            display_name TEXT,
+            total_calories INTEGER NOT NULL,
+            times INTEGER NOT NULL,
+            updated_at REAL,
+            UNIQUE (user_id, name)
+        )
+        """,
+        "CREATE VIRTUAL TABLE IF NOT EXISTS food_index_fts USING fts5(name, content='food_index', content_rowid='id')",
+        """
+        CREATE TRIGGER IF NOT EXISTS food_index_ai AFTER INSERT ON food_index BEGIN
+            INSERT INTO food_index_fts (rowid, name) VALUES (new.id, new.name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS food_index_ad AFTER DELETE ON food_index BEGIN
+            INSERT INTO food_index_fts (food_index_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+        """,
+        lambda conn: _rebuild_food_index(conn),
+    ]),
+    (10, [
+        # Outgoing WhatsApp messages, one row per <=1600-char part. See app/outbox.py.
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            destination TEXT NOT NULL,
+            body TEXT NOT NULL,
+            part INTEGER NOT NULL DEFAULT 1,
+            parts INTEGER NOT NULL DEFAULT 1,
+            source TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            provider_sid TEXT,
+            last_error TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_due ON outbox(status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_destination ON outbox(destination, status, id)",
+    ]),
+    (11, [
+        # Rolling conversation summaries (app/context_window.py), so a restart
+        # doesn't re-summarize a thread's whole history in one call.
+        """
+        CREATE TABLE IF NOT EXISTS thread_summaries (
+            thread_id TEXT PRIMARY KEY,
+            turns_covered INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version():
+    return query_one("PRAGMA user_version")[0]
+
+
+def migrate():
+    """
+    Applies any pending migrations, each in its own transaction. Returns the final version.
+    The app, Streamlit and scheduler.py may start together, so the version is
+    re-read under the write lock and steps another process applied are skipped.
+    """
+    current = schema_version()
+    for version, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        with transaction() as conn:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+        # stderr: CLIs such as `food_logs export -` own stdout.
+        print(f"[DB] Migrated schema to version {version}.", file=sys.stderr)
+        current = version
+    return current
+
+
+_migrated = False
 
-DB_PATH = "nutriagent.db"
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users(
-    id INTEGER PRIMARY KEY,
-    access_token TEXT,
-    refresh_token TEXT,
-    expires_at REAL,
-    height REAL,
-    Weight REAL,
-    goal TEXT,
-    daily_calorie_target INTEGER
-    )
+    """Brings the schema up to date. Cheap to call repeatedly; only the first call in a process does work."""
+    global _migrated
+    if _migrated:
+        return
+    migrate()
+    _migrated = True
+    print("Database initialized successfully.", file=sys.stderr)
+
+def _rebuild_daily_totals(conn):
+    conn.execute("DELETE FROM daily_totals")
+    conn.execute("""
+        INSERT INTO daily_totals (user_id, date, calories_in)
+        SELECT user_id, date, SUM(calories_in) FROM daily_logs
+        WHERE user_id IS NOT NULL AND date IS NOT NULL
+        GROUP BY user_id, date
     """)
 
-    cursor.execute("INSERT or IGNORE INTO users (id) VALUES (1)")
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully.")
 
-def update_token(access_token, refresh_token, expires_at):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    UPDATE users 
+def rebuild_daily_totals():
+    """Recomputes the daily_totals rollup from daily_logs (backfill / repair)."""
+    with transaction() as conn:
+        _rebuild_daily_totals(conn)
+    return query_one("SELECT COUNT(*) FROM daily_totals")[0]
+
+
+def normalize_food_name(name):
+    """Canonical key for a food: lowercase words, no punctuation or articles, naive singular."""
+    words = []
+    for word in re.sub(r"[^a-z0-9]+", " ", str(name).lower()).split():
+        if word in ("a", "an", "the", "of", "some"):
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+_FOOD_INDEX_UPSERT = """
+    INSERT INTO food_index (user_id, name, display_name, total_calories, times, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, name) DO UPDATE SET
+        total_calories = total_calories + excluded.total_calories,
+        times = times + excluded.times,
+        display_name = excluded.display_name,
+        updated_at = excluded.updated_at
+"""
+
+
+def _index_food(conn, user_id, food_name, calories, times=1):
+    name = normalize_food_name(food_name)
+    if not name:
+        return
+    conn.execute(_FOOD_INDEX_UPSERT, (user_id, name, food_name, calories, times, time.time()))
+
+
+def _rebuild_food_index(conn):
+    conn.execute("DELETE FROM food_index WHERE user_id != 0")
+    rows = conn.execute("""
+        SELECT user_id, food_name, SUM(calories_in), COUNT(*) FROM daily_logs
+        WHERE user_id IS NOT NULL AND food_name IS NOT NULL AND calories_in IS NOT NULL
+        GROUP BY user_id, food_name
+    """).fetchall()
+    for user_id, food_name, total, count in rows:
+        _index_food(conn, user_id, food_name, total, count)
+
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def add_food_log(food_name, calories, user_id=1):
+    """Inserts a food entry and bumps the day's rollup and the food index in the same transaction."""
+    today = _today()
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO daily_logs (date, user_id, food_name, calories_in) VALUES (?, ?, ?, ?)",
+            (today, user_id, food_name, calories),
+        )
+        conn.execute("""
+            INSERT INTO daily_totals (user_id, date, calories_in) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, date) DO UPDATE SET calories_in = calories_in + excluded.calories_in
+        """, (user_id, today, calories))
+        _index_food(conn, user_id, food_name, calories)
+
+
+def add_food_logs(rows, user_id):
+    """
+    Bulk add_food_log: inserts (date, food_name, calories) rows in one
+    transaction and folds their per-day and per-food sums into the rollup
+    and the food index, so a batch costs a few upserts instead of one per row.
+    """
+    days, foods = {}, {}
+    for day, food_name, calories in rows:
+        days[day] = days.get(day, 0) + calories
+        total, times = foods.get(food_name, (0, 0))
+        foods[food_name] = (total + calories, times + 1)
+
+    indexed = {}
+    for food_name, (total, times) in foods.items():
+        name = normalize_food_name(food_name)
+        if name:
+            _, old_total, old_times = indexed.get(name, (None, 0, 0))
+            indexed[name] = (food_name, old_total + total, old_times + times)
+
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO daily_logs (date, user_id, food_name, calories_in) VALUES (?, ?, ?, ?)",
+            ((day, user_id, food_name, calories) for day, food_name, calories in rows),
+        )
+        conn.executemany("""
+            INSERT INTO daily_totals (user_id, date, calories_in) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, date) DO UPDATE SET calories_in = calories_in + excluded.calories_in
+        """, [(user_id, day, total) for day, total in days.items()])
+        conn.executemany(_FOOD_INDEX_UPSERT, [
+            (user_id, name, food_name, total, times, now) for name, (food_name, total, times) in indexed.items()
+        ])
+
+
+def reset_user(user_id=1):
+    """Clears the profile, food history, rollup and food index for a user."""
+    with transaction() as conn:
+        conn.execute("UPDATE users SET weight = NULL, daily_calorie_target = NULL WHERE id = ?", (user_id,))
+        conn.execute("DELETE FROM daily_logs WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM daily_totals WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM food_index WHERE user_id = ?", (user_id,))
+
+
+def get_eaten_today(user_id=1):
+    row = query_one("SELECT calories_in FROM daily_totals WHERE user_id = ? AND date = ?", (user_id, _today()))
+    return row[0] if row else 0
+
+
+def get_average_daily_intake(days, user_id=1):
+    """Average calories per logged day over the last `days` days, or None if nothing was logged."""
+    row = query_one(
+        "SELECT AVG(calories_in) FROM daily_totals WHERE user_id = ? AND date >= date('now', 'localtime', ?)",
+        (user_id, f"-{int(days)} days"),
+    )
+    return row[0] if row else None
+
+
+def get_or_create_user(sender):
+    """Returns the users.id for a sender identity, creating the row on first contact."""
+    row = query_one("SELECT id FROM users WHERE sender = ?", (sender,))
+    if row:
+        return row[0]
+    execute("INSERT OR IGNORE INTO users (sender) VALUES (?)", (sender,))
+    return query_one("SELECT id FROM users WHERE sender = ?", (sender,))[0]
+
+
+def find_user_id(sender):
+    """The users.id for a sender identity, or None; never creates a row."""
+    row = query_one("SELECT id FROM users WHERE sender = ?", (str(sender),))
+    return row[0] if row else None
+
+
+@lru_cache(maxsize=USER_CACHE_SIZE)
+def resolve_user_id(sender):
+    """Cached sender -> user id lookup. A sender's id never changes, so entries never go stale."""
+    return get_or_create_user(str(sender))
+
+
+def is_whatsapp_sender(sender):
+    return str(sender or "").startswith(WHATSAPP_PREFIX)
+
+
+def get_active_users():
+    """Returns (id, sender) for every active WhatsApp user."""
+    return query_all(
+        "SELECT id, sender FROM users WHERE active = 1 AND sender LIKE ? ORDER BY id", (WHATSAPP_PREFIX + "%",)
+    )
+
+
+def update_token(access_token, refresh_token, expires_at, user_id=1):
+    execute("""
+    UPDATE users
     SET access_token = ?, refresh_token = ?, expires_at = ?
-    where id = 1
-    """, (access_token, refresh_token, expires_at))
-    conn.commit()
-    conn.close()
-
-def get_tokens():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""SELECT access_token, refresh_token, expires_at FROM users where id=1""")
-    row = cursor.fetchone()
-    conn.close()
+    where id = ?
+    """, (access_token, refresh_token, expires_at, user_id))
+
+def get_tokens(user_id=1):
+    row = query_one("""SELECT access_token, refresh_token, expires_at FROM users where id=?""", (user_id,))
 
     if row and row[0]:
         return {
@@ -50,4 +576,22 @@ def get_tokens():
         }
     return None
 
+def get_calorie_target(user_id=1):
+    """Returns the user's daily calorie target, or None if not onboarded."""
+    row = query_one("SELECT daily_calorie_target FROM users WHERE id = ?", (user_id,))
+    return row[0] if row else None
+
+def update_profile(weight, target_calories, user_id=1):
+    execute("UPDATE users SET weight = ?, daily_calorie_target = ? WHERE id = ?", (weight, target_calories, user_id))
+
+if __name__ == "__main__":
+    import sys
 
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        print(f"Schema version: {migrate()}")
+    elif command == "backfill-totals":
+        migrate()
+        print(f"Rebuilt daily_totals: {rebuild_daily_totals()} rows.")
+    else:
+        print("Usage: python -m app.database [migrate|backfill-totals]")
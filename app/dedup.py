@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from app import database
+
+# Twilio retries for a few minutes at most; a day is a comfortable margin.
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW_SECONDS", 86400))
+LRU_SIZE = int(os.getenv("DEDUP_LRU_SIZE", 10000))
+
+
+class MessageDeduper:
+    """
+    Remembers which Twilio MessageSids we've accepted, so webhook retries
+    never run the graph twice. Recent sids live in an in-memory LRU; the
+    processed_messages table makes it survive restarts and multiple workers.
+    """
+
+    def __init__(self, window=DEDUP_WINDOW, lru_size=LRU_SIZE):
+        self.window = window
+        self.lru_size = lru_size
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()  # sid -> (status, response)
+        self.accepted = 0
+        self.duplicates = 0
+
+    def _remember(self, sid, status, response=None):
+        with self._lock:
+            self._recent[sid] = (status, response)
+            self._recent.move_to_end(sid)
+            while len(self._recent) > self.lru_size:
+                self._recent.popitem(last=False)
+
+    def claim(self, sid, sender):
+        """
+        Returns None if this sid is new (and records it as pending), otherwise
+        the stored (status, response) of the earlier delivery.
+        """
+        with self._lock:
+            cached = self._recent.get(sid)
+            if cached:
+                self._recent.move_to_end(sid)
+                self.duplicates += 1
+                return cached
+
+        now = time.time()
+        inserted = database.execute("""
+            INSERT INTO processed_messages (message_sid, sender, received_at) VALUES (?, ?, ?)
+            ON CONFLICT(message_sid) DO UPDATE SET sender = excluded.sender, received_at = excluded.received_at,
+                status = 'pending', response = NULL
+            WHERE processed_messages.received_at < ?
+        """, (sid, sender, now, now - self.window)).rowcount
+        if inserted:
+            self.accepted += 1
+            self._remember(sid, "pending")
+            return None
+
+        row = database.query_one("SELECT status, response FROM processed_messages WHERE message_sid = ?", (sid,))
+        self.duplicates += 1
+        self._remember(sid, row[0], row[1])
+        return (row[0], row[1])
+
+    def complete(self, sid, response):
+        database.execute(
+            "UPDATE processed_messages SET status = 'done', response = ? WHERE message_sid = ?",
+            (response, sid),
+        )
+        self._remember(sid, "done", response)
+
+    def release(self, sid):
+        """Forgets a claim (e.g. the turn failed before doing anything) so a retry is processed."""
+        database.execute("DELETE FROM processed_messages WHERE message_sid = ?", (sid,))
+        with self._lock:
+            self._recent.pop(sid, None)
+
+    def prune(self):
+        """Deletes records older than the dedup window. Returns the number removed."""
+        return database.execute(
+            "DELETE FROM processed_messages WHERE received_at < ?", (time.time() - self.window,)
+        ).rowcount
+
+    def stats(self):
+        return {"accepted": self.accepted, "duplicates_suppressed": self.duplicates, "cached": len(self._recent)}
@@ -1,56 +1,272 @@
 import os
+import re
 import time
+import threading
 import requests
 import base64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from app import database
+from app import database, metrics
 
 load_dotenv()
 
-class FitbitClient:
+# Seconds a cached Fitbit reading stays fresh, per endpoint. Activity moves
+# every few minutes; last night's sleep barely changes during the day.
+CACHE_TTLS = {
+    "activity": int(os.getenv("FITBIT_CACHE_TTL_ACTIVITY", 300)),
+    "sleep": int(os.getenv("FITBIT_CACHE_TTL_SLEEP", 1800)),
+}
+
+# Overridable so the client can be pointed at a local stub server.
+API_BASE = os.getenv("FITBIT_API_BASE", "https://api.fitbit.com")
+REQUEST_TIMEOUT = 10
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds, doubled per attempt
+MAX_RATE_LIMIT_WAIT = 30  # give up (and serve cache) rather than block longer
+HOURLY_QUOTA = 150  # Fitbit's default per-user limit
+MAX_CLIENTS = int(os.getenv("FITBIT_MAX_CLIENTS", 256))  # per-user clients kept, least recently used dropped
+POOL_SIZE = int(os.getenv("FITBIT_POOL_SIZE", 16))  # connections and get_day_summary threads, for all users
+
+# One keep-alive session and one worker pool for every user's client, so
+# connections are reused across users and evicted clients leave nothing behind.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE))
+session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE))
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="fitbit")
+
+
+def _retry_after(value, default):
+    """Seconds to wait from a Retry-After header (seconds or an HTTP date); `default` if missing or malformed."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+
+def _endpoint(path):
+    """Low-cardinality metric label for a request path: dates dropped, e.g. /1/user/-/activities."""
+    return re.sub(r"/date/.*$", "", path)
+
+
+class FitbitError(Exception):
+    """Raised when a Fitbit read fails and no value could be produced."""
+
+
+class TTLCache:
+    """
+    Small thread-safe TTL cache with single-flight loading.
+    Concurrent get_or_fetch() calls for the same key share one fetch, and if
+    a refresh fails the last good value is served (stale) instead.
+    """
+
     def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}    # key -> (value, fetched_at)
+        self._inflight = {}  # key -> threading.Event
+        self._errors = {}    # key -> exception from the last shared fetch
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.errors = 0
+
+    def get_or_fetch(self, key, ttl, fetch):
+        while True:
+            with self._lock:
+                entry = self._values.get(key)
+                if entry and time.time() - entry[1] < ttl:
+                    self.hits += 1
+                    return entry[0]
+                event = self._inflight.get(key)
+                if event is None:
+                    # We're the leader for this key.
+                    self.misses += 1
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    break
+            # Someone else is fetching: wait for them and re-check.
+            event.wait()
+            with self._lock:
+                entry = self._values.get(key)
+                error = self._errors.get(key)
+                if entry and time.time() - entry[1] < ttl:
+                    self.hits += 1
+                    return entry[0]
+                if error is not None:
+                    if entry:
+                        self.stale += 1
+                        return entry[0]
+                    raise error
+
+        try:
+            value = fetch()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self._errors[key] = e
+                del self._inflight[key]
+                stale = self._values.get(key)
+                if stale:
+                    self.stale += 1
+            event.set()
+            if stale:
+                print(f"⚠️ [Fitbit] Refresh failed, serving cached value for {key}")
+                return stale[0]
+            raise
+
+        with self._lock:
+            self._values[key] = (value, time.time())
+            self._errors.pop(key, None)
+            del self._inflight[key]
+        event.set()
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_served": self.stale,
+                "errors": self.errors,
+                "size": len(self._values),
+            }
+
+
+class RateLimiter:
+    """
+    Token bucket sized to Fitbit's hourly quota. The bucket is re-synced from
+    the Fitbit-Rate-Limit-* response headers, so it tracks the real server
+    budget rather than our own guess.
+    """
+
+    def __init__(self, limit=HOURLY_QUOTA, period=3600):
+        self._lock = threading.Lock()
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        rate = self.limit / self.period
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def acquire(self, max_wait=MAX_RATE_LIMIT_WAIT):
+        """Takes one token, sleeping if needed. Raises FitbitError if the wait would exceed max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.blocked_until - now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) * self.period / self.limit)
+            if wait > max_wait:
+                raise FitbitError(f"Rate limited for another {wait:.0f}s")
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+    def update_from_headers(self, headers):
+        try:
+            limit, remaining, reset = (
+                None if headers.get(name) is None else int(headers[name])
+                for name in ("Fitbit-Rate-Limit-Limit", "Fitbit-Rate-Limit-Remaining", "Fitbit-Rate-Limit-Reset")
+            )
+        except ValueError:
+            return  # malformed headers: keep our own estimate
+        with self._lock:
+            now = time.monotonic()
+            if limit is not None:
+                self.limit = max(1, limit)
+            if remaining is not None:
+                self.tokens = float(remaining)
+                self.updated = now
+            if reset is not None and remaining is not None and remaining <= 0:
+                self.blocked_until = now + reset
+
+    def block_for(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class FitbitClient:
+    def __init__(self, user_id=1, cache_ttls=None, base_url=None):
         self.client_id = os.getenv("FITBIT_CLIENT_ID")
         self.client_secret = os.getenv("FITBIT_CLIENT_SECRET")
+        self.user_id = user_id
+        self.base_url = (base_url or API_BASE).rstrip("/")
+        self.cache_ttls = dict(CACHE_TTLS, **(cache_ttls or {}))
+        self.cache = TTLCache()
+        self.limiter = RateLimiter()
+        self._refresh_lock = threading.Lock()
+        self.session = session
         self.tokens = self.load_tokens()
 
     def load_tokens(self):
         """Loads tokens from the JSON file."""
-        tokens = database.get_tokens()
+        tokens = database.get_tokens(self.user_id)
         if not tokens:
             print("Error: Tokens not found in DB. Run get_tokens.py first.")
         return tokens
-        
+
     def save_tokens(self, tokens):
         """Updates SQLite with new tokens."""
         expires_at = time.time() + tokens.get("expires_in",28800)
-        database.update_tokens(tokens["access_token"],tokens["refresh_token"],expires_at)
+        database.update_token(tokens["access_token"],tokens["refresh_token"],expires_at,self.user_id)
         self.tokens = self.load_tokens()
         print("[Fitbit] Tokens refreshed and saved to SQLite.")
 
+    def _cached(self, endpoint, date_str, fetch):
+        """Serves `endpoint` for this user/day from the cache, falling back to 0 if nothing is available."""
+        key = (endpoint, self.user_id, date_str)
+        try:
+            return self.cache.get_or_fetch(key, self.cache_ttls[endpoint], fetch)
+        except FitbitError:
+            return 0
+
+    def cache_stats(self):
+        return self.cache.stats()
 
     def get_sleep_today(self):
         """Fetches total sleep minutes for today."""
-        if not self.ensure_active_token(): return 0
-        
         date_str = datetime.now().strftime("%Y-%m-%d")
+        return self._cached("sleep", date_str, lambda: self._fetch_sleep(date_str))
+
+    def _fetch_sleep(self, date_str):
+        if not self.ensure_active_token():
+            raise FitbitError("No active token")
+
         # Note: Sleep uses API v1.2
-        url = f"https://api.fitbit.com/1.2/user/-/sleep/date/{date_str}.json"
-        
         print(f"\n💤 [Fitbit] Fetching sleep for {date_str}...")
-        response = requests.get(url, headers=self._get_headers())
-        
+        response = self._get(f"/1.2/user/-/sleep/date/{date_str}.json")
+
         if response.status_code == 200:
             data = response.json()
             # Fitbit returns a summary object
             summary = data.get("summary", {})
             total_minutes = summary.get("totalMinutesAsleep", 0)
-            
+
             print(f"✅ [Fitbit] Sleep Found: {total_minutes} mins")
             return total_minutes
         else:
             print(f"❌ [Fitbit] Sleep Error: {response.text}")
-            return 0
+            raise FitbitError(response.text)
 
     def _get_headers(self):
         if not self.tokens: return {}
@@ -58,23 +274,83 @@ class FitbitClient:
 
     def ensure_active_token(self):
         """Checks expiry and refreshes if needed."""
-        if not self.tokens: return False
-        
+        if not self.tokens:
+            # The user may have linked Fitbit since this client was built.
+            self.tokens = database.get_tokens(self.user_id)
+            if not self.tokens: return False
+
         # Buffer of 5 minutes
         if time.time() > self.tokens.get("expires_at", 0) - 300:
             print("🔄 [Fitbit] Token expired. Refreshing...")
-            return self.refresh_token()
+            return self.refresh_token(self.tokens["access_token"])
         return True
 
-    def refresh_token(self):
-        url = "https://api.fitbit.com/oauth2/token"
+    def _get(self, path):
+        """
+        GET against the Fitbit API with rate limiting, bounded retries and a
+        single token refresh on 401. Returns the final response.
+        """
+        url = f"{self.base_url}{path}"
+        endpoint = _endpoint(path)
+        delay = RETRY_BACKOFF
+        refreshed = False
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire()
+            access_token = self.tokens["access_token"] if self.tokens else None
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=self._get_headers(), timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                metrics.FITBIT_SECONDS.observe(time.perf_counter() - start, endpoint)
+                metrics.FITBIT_RESPONSES.inc(endpoint, type(e).__name__)
+                if attempt == MAX_RETRIES:
+                    raise FitbitError(str(e))
+                time.sleep(delay)
+                delay *= 2
+                continue
+
+            metrics.FITBIT_SECONDS.observe(time.perf_counter() - start, endpoint)
+            metrics.FITBIT_RESPONSES.inc(endpoint, str(response.status_code))
+            self.limiter.update_from_headers(response.headers)
+
+            if response.status_code == 401 and not refreshed:
+                print("⚠️ [Fitbit] Unexpected 401. Forcing refresh...")
+                refreshed = True
+                if not self.refresh_token(access_token):
+                    raise FitbitError("Token refresh failed")
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == MAX_RETRIES:
+                    return response
+                wait = _retry_after(response.headers.get("Retry-After"), delay)
+                if response.status_code == 429:
+                    self.limiter.block_for(wait)
+                else:
+                    time.sleep(wait)
+                delay *= 2
+                continue
+            return response
+        return response
+
+    def refresh_token(self, stale_access_token=None):
+        """
+        Refreshes the OAuth token. Serialised under a lock: if another thread
+        already replaced `stale_access_token` while we waited, we reuse theirs.
+        """
+        with self._refresh_lock:
+            if stale_access_token and self.tokens and self.tokens["access_token"] != stale_access_token:
+                return True
+            return self._refresh_token()
+
+    def _refresh_token(self):
+        url = f"{self.base_url}/oauth2/token"
         auth_str = f"{self.client_id}:{self.client_secret}"
         b64_auth = base64.b64encode(auth_str.encode()).decode()
-        
+
         headers = {"Authorization": f"Basic {b64_auth}", "Content-Type": "application/x-www-form-urlencoded"}
         data = {"grant_type": "refresh_token", "refresh_token": self.tokens["refresh_token"]}
-        
-        response = requests.post(url, headers=headers, data=data)
+
+        response = self.session.post(url, headers=headers, data=data, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
             self.save_tokens(response.json())
             return True
@@ -83,24 +359,97 @@ class FitbitClient:
             return False
 
     def get_calories_today(self):
-            if not self.ensure_active_token(): return 0
-            
-            date_str = datetime.now().strftime("%Y-%m-%d")
-            url = f"https://api.fitbit.com/1/user/-/activities/date/{date_str}.json"
-            
-            print(f"\n📡 [Fitbit] Fetching data for {date_str}...")
-            response = requests.get(url, headers=self._get_headers())
-            
-            if response.status_code == 200:
-                cal = response.json().get("summary", {}).get("activityCalories", 0)
-                print(f"✅ [Fitbit] Active Calories Burned: {cal}")
-                return cal
-            elif response.status_code == 401:
-                print("⚠️ [Fitbit] Unexpected 401. Forcing refresh...")
-                if self.refresh_token():
-                    return self.get_calories_today() 
-            else:
-                print(f"❌ [Fitbit] API Error: {response.text}")
-                return 0
+        """Fetches active calories burned today."""
+        date_str = datetime.now().strftime("%Y-%m-%d")
+        return self._cached("activity", date_str, lambda: self._fetch_calories(date_str))
+
+    def _fetch_calories(self, date_str):
+        if not self.ensure_active_token():
+            raise FitbitError("No active token")
+
+        print(f"\n📡 [Fitbit] Fetching data for {date_str}...")
+        response = self._get(f"/1/user/-/activities/date/{date_str}.json")
+
+        if response.status_code == 200:
+            cal = response.json().get("summary", {}).get("activityCalories", 0)
+            print(f"✅ [Fitbit] Active Calories Burned: {cal}")
+            return cal
+        else:
+            print(f"❌ [Fitbit] API Error: {response.text}")
+            raise FitbitError(response.text)
+
+    def get_range(self, path, start, end):
+        """Fetches a date-range resource (start/end as YYYY-MM-DD) and returns the JSON body."""
+        if not self.ensure_active_token():
+            raise FitbitError("No active token")
+
+        print(f"\n🗓️ [Fitbit] Fetching {path} for {start}..{end}...")
+        response = self._get(f"{path}/date/{start}/{end}.json")
+        if response.status_code != 200:
+            print(f"❌ [Fitbit] Range Error: {response.text}")
+            raise FitbitError(response.text)
+        return response.json()
+
+    def get_activity_calories_range(self, start, end):
+        """Returns {date: activity calories} for each day in the range."""
+        data = self.get_range("/1/user/-/activities/activityCalories", start, end)
+        return {row["dateTime"]: int(row["value"]) for row in data.get("activities-activityCalories", [])}
+
+    def get_sleep_range(self, start, end):
+        """Returns {date: minutes asleep}, summing every sleep log that ends on that date."""
+        data = self.get_range("/1.2/user/-/sleep", start, end)
+        minutes = {}
+        for log in data.get("sleep", []):
+            day = log["dateOfSleep"]
+            minutes[day] = minutes.get(day, 0) + log.get("minutesAsleep", 0)
+        return minutes
+
+    def get_resting_heart_rate_range(self, start, end):
+        """Returns {date: resting heart rate} for days where Fitbit computed one."""
+        data = self.get_range("/1/user/-/activities/heart", start, end)
+        return {
+            row["dateTime"]: row["value"]["restingHeartRate"]
+            for row in data.get("activities-heart", [])
+            if "restingHeartRate" in row.get("value", {})
+        }
+
+    def get_day_summary(self):
+        """Fetches today's activity calories and sleep in parallel (each through the cache)."""
+        calories = _executor.submit(self.get_calories_today)
+        sleep = _executor.submit(self.get_sleep_today)
+        return {"calories_burned": calories.result(), "sleep_minutes": sleep.result()}
+
+_clients = OrderedDict()  # user_id -> FitbitClient, least recently used first
+_clients_lock = threading.Lock()
+_retired_stats = {}  # cache counters of evicted clients, so the totals never go backwards
+
+def get_client(user_id):
+    """
+    Returns the shared FitbitClient for a user, so its cache and rate limiter
+    are reused. At most MAX_CLIENTS are kept; the least recently used is
+    dropped (it holds only its cache and rate limiter).
+    """
+    with _clients_lock:
+        client = _clients.get(user_id)
+        if client is None:
+            client = _clients[user_id] = FitbitClient(user_id)
+        _clients.move_to_end(user_id)
+        while len(_clients) > MAX_CLIENTS:
+            _, evicted = _clients.popitem(last=False)
+            for key, value in evicted.cache_stats().items():
+                if key != "size":
+                    _retired_stats[key] = _retired_stats.get(key, 0) + value
+        return client
 
-fitbit = FitbitClient()
\ No newline at end of file
+def cache_stats():
+    """Reading-cache counters summed over every user's client."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        retired = dict(_retired_stats)
+    totals = {"clients": len(clients), "hits": 0, "misses": 0, "stale_served": 0, "errors": 0, "size": 0}
+    for key, value in retired.items():
+        totals[key] += value
+    for client in clients:
+        for key, value in client.cache_stats().items():
+            totals[key] += value
+    return totals
@@ -0,0 +1,117 @@
+"""
+Bulk sync of Fitbit daily series into the local fitbit_daily table.
+
+The first run backfills BACKFILL_DAYS using Fitbit's date-range endpoints
+(one request per series per chunk instead of one per day). Later runs
+resume from each series' high-water mark, re-fetching only the last synced
+day (which may have been partial) up to today.
+
+Usage: python -m app.fitbit_sync [backfill_days] [sender]
+"""
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+from app import database
+from app.fitbit_client import FitbitError
+
+BACKFILL_DAYS = int(os.getenv("FITBIT_BACKFILL_DAYS", 30))
+# Sleep range requests are capped at 100 days by Fitbit; use it for all series.
+CHUNK_DAYS = 100
+# How old local data may get before a history read triggers a sync.
+SYNC_MAX_AGE = int(os.getenv("FITBIT_SYNC_MAX_AGE", 900))
+
+# series name -> (FitbitClient method name, fitbit_daily column)
+SERIES = {
+    "activity": ("get_activity_calories_range", "activity_calories"),
+    "sleep": ("get_sleep_range", "sleep_minutes"),
+    "heart": ("get_resting_heart_rate_range", "resting_heart_rate"),
+}
+
+
+def _chunks(start, end):
+    while start <= end:
+        stop = min(end, start + timedelta(days=CHUNK_DAYS - 1))
+        yield start, stop
+        start = stop + timedelta(days=1)
+
+
+def _sync_state(user_id, resource):
+    return database.query_one(
+        "SELECT synced_through, synced_at FROM fitbit_sync_state WHERE user_id = ? AND resource = ?",
+        (user_id, resource),
+    )
+
+
+def sync_series(client, resource, backfill_days=BACKFILL_DAYS):
+    """Syncs one series for client.user_id from its high-water mark to today. Returns the number of days written."""
+    user_id = client.user_id
+    method, column = SERIES[resource]
+    today = date.today()
+    state = _sync_state(user_id, resource)
+    if state and state[0]:
+        start = date.fromisoformat(state[0])
+    else:
+        start = today - timedelta(days=backfill_days - 1)
+
+    written = 0
+    for chunk_start, chunk_end in _chunks(start, today):
+        values = getattr(client, method)(chunk_start.isoformat(), chunk_end.isoformat())
+        with database.transaction() as conn:
+            conn.executemany(f"""
+                INSERT INTO fitbit_daily (user_id, date, {column}) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, date) DO UPDATE SET {column} = excluded.{column}
+            """, [(user_id, day, value) for day, value in values.items()])
+            conn.execute("""
+                INSERT INTO fitbit_sync_state (user_id, resource, synced_through, synced_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, resource) DO UPDATE SET synced_through = excluded.synced_through, synced_at = excluded.synced_at
+            """, (user_id, resource, chunk_end.isoformat(), time.time()))
+        written += len(values)
+    return written
+
+
+def sync_all(client, backfill_days=BACKFILL_DAYS):
+    """Syncs every series. A failing series is reported and skipped so the others still update."""
+    results = {}
+    for resource in SERIES:
+        try:
+            results[resource] = sync_series(client, resource, backfill_days)
+        except FitbitError as e:
+            print(f"❌ [Sync] {resource} failed: {e}")
+            results[resource] = None
+    return results
+
+
+def sync_if_stale(client, max_age=SYNC_MAX_AGE):
+    """Runs sync_all only if some series hasn't been synced within max_age seconds."""
+    oldest = database.query_one(
+        "SELECT COUNT(*), MIN(synced_at) FROM fitbit_sync_state WHERE user_id = ?", (client.user_id,)
+    )
+    if oldest[0] == len(SERIES) and time.time() - oldest[1] < max_age:
+        return None
+    return sync_all(client)
+
+
+def get_daily_averages(days, user_id=1):
+    """Averages of the locally stored series over the last `days` days (None where there's no data)."""
+    row = database.query_one("""
+        SELECT AVG(activity_calories), AVG(sleep_minutes), AVG(resting_heart_rate), COUNT(*)
+        FROM fitbit_daily
+        WHERE user_id = ? AND date >= date('now', 'localtime', ?)
+    """, (user_id, f"-{int(days)} days"))
+    return {
+        "activity_calories": row[0],
+        "sleep_minutes": row[1],
+        "resting_heart_rate": row[2],
+        "days_with_data": row[3],
+    }
+
+
+if __name__ == "__main__":
+    from app.fitbit_client import get_client
+
+    database.init_db()
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else BACKFILL_DAYS
+    user_id = database.resolve_user_id(sys.argv[2]) if len(sys.argv) > 2 else 1
+    print(f"[Sync] Results: {sync_all(get_client(user_id), backfill_days=days)}")
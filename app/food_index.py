@@ -0,0 +1,106 @@
+"""
+Local calorie lookup for foods, so repeat meals don't need an LLM estimate.
+
+Entries come from the user's own daily_logs (kept up to date by
+database.add_food_log) and, optionally, a bundled nutrition table loaded
+from CSV under user_id 0. Lookups try the exact normalised name first (one
+index seek), then FTS5 candidates ranked by string similarity.
+
+Usage: python -m app.food_index load-csv data/foods.csv
+"""
+import csv
+import sys
+import time
+from difflib import SequenceMatcher
+
+from app import database
+
+GLOBAL_USER = 0
+FUZZY_THRESHOLD = 0.8
+CANDIDATES = 20
+
+
+def _result(row, match):
+    name, display_name, total, times, user_id = row
+    return {
+        "name": display_name or name,
+        "calories": round(total / times),
+        "times_logged": times if user_id != GLOBAL_USER else 0,
+        "source": "nutrition table" if user_id == GLOBAL_USER else "your past logs",
+        "match": match,
+    }
+
+
+def lookup(food_name, user_id=1):
+    """Returns the best known entry for food_name, preferring the user's own history, or None."""
+    name = database.normalize_food_name(food_name)
+    if not name:
+        return None
+
+    row = database.query_one("""
+        SELECT name, display_name, total_calories, times, user_id FROM food_index
+        WHERE name = ? AND user_id IN (?, ?) ORDER BY user_id = ? DESC LIMIT 1
+    """, (name, user_id, GLOBAL_USER, user_id))
+    if row:
+        return _result(row, "exact")
+
+    query = " OR ".join(f'"{word}"*' for word in name.split())
+    rows = database.query_all("""
+        SELECT f.name, f.display_name, f.total_calories, f.times, f.user_id
+        FROM food_index_fts JOIN food_index f ON f.id = food_index_fts.rowid
+        WHERE food_index_fts MATCH ? AND f.user_id IN (?, ?)
+        ORDER BY rank LIMIT ?
+    """, (query, user_id, GLOBAL_USER, CANDIDATES))
+
+    best, best_score = None, 0.0
+    for candidate in rows:
+        score = SequenceMatcher(None, name, candidate[0]).ratio()
+        # Prefer the user's own entry on ties.
+        if score > best_score or (score == best_score and candidate[4] == user_id):
+            best, best_score = candidate, score
+    if best and best_score >= FUZZY_THRESHOLD:
+        return _result(best, "fuzzy")
+    return None
+
+
+def load_csv(path, batch_size=500):
+    """
+    Loads a nutrition table (columns: name, calories[, serving]) as global
+    entries, replacing any existing ones with the same name. Returns rows loaded.
+    """
+    loaded = 0
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        batch = []
+        for row in reader:
+            name = database.normalize_food_name(row["name"])
+            if not name or not row.get("calories"):
+                continue
+            display = f"{row['name']} ({row['serving']})" if row.get("serving") else row["name"]
+            batch.append((GLOBAL_USER, name, display, int(float(row["calories"])), 1, time.time()))
+            if len(batch) >= batch_size:
+                loaded += _write_global(batch)
+                batch = []
+        loaded += _write_global(batch)
+    return loaded
+
+
+def _write_global(batch):
+    if not batch:
+        return 0
+    with database.transaction() as conn:
+        conn.executemany("""
+            INSERT INTO food_index (user_id, name, display_name, total_calories, times, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, name) DO UPDATE SET display_name = excluded.display_name,
+                total_calories = excluded.total_calories, times = excluded.times, updated_at = excluded.updated_at
+        """, batch)
+    return len(batch)
+
+
+if __name__ == "__main__":
+    database.init_db()
+    if len(sys.argv) == 3 and sys.argv[1] == "load-csv":
+        print(f"Loaded {load_csv(sys.argv[2])} foods into the index.")
+    else:
+        print("Usage: python -m app.food_index load-csv <path.csv>")
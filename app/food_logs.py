@@ -0,0 +1,325 @@
+"""
+Bulk import/export of food history (daily_logs).
+
+Imports stream rows from CSV, a JSON array or JSON lines, validate each one
+and hand them to database.add_food_logs in batches of BATCH_SIZE: one
+transaction per batch with executemany inserts, and daily_totals/food_index
+updated from the batch's per-day and per-food sums in that same
+transaction. Memory stays flat, every committed batch leaves the
+aggregates consistent, and a million rows take seconds. Exports read with
+fetchmany and yield encoded chunks, for files or a StreamingResponse.
+
+Fields: date (YYYY-MM-DD, a timestamp is cut to its date), food_name (or
+food/name/item), calories (or calories_in/kcal). CSV headers are matched
+case-insensitively.
+
+Usage: python -m app.food_logs import <path|-> [--sender 1] [--format csv|json|jsonl] [--dry-run]
+       python -m app.food_logs export [path|-] [--sender 1] [--format csv|json|jsonl] [--start D] [--end D]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+from datetime import date
+
+from app import database
+
+FORMATS = ("csv", "json", "jsonl")
+CONTENT_TYPES = {"csv": "text/csv", "json": "application/json", "jsonl": "application/x-ndjson"}
+BATCH_SIZE = 50000       # rows per insert transaction
+FETCH_SIZE = 5000        # rows per export read
+READ_CHUNK = 1 << 16     # characters per JSON array read
+MAX_ELEMENT = 1 << 20    # characters one JSON array element may span
+MAX_ERRORS = 20          # invalid rows reported back, the rest are only counted
+MAX_CALORIES = 10000
+MAX_NAME = 200
+
+FIELDS = {
+    "date": ("date", "day"),
+    "food_name": ("food_name", "food", "name", "item"),
+    "calories": ("calories", "calories_in", "kcal"),
+}
+
+
+def _pick(record):
+    """(date, food_name, calories) raw values from a JSON object, None for anything else."""
+    if not isinstance(record, dict):
+        return None
+    values = []
+    for aliases in FIELDS.values():
+        value = None
+        for alias in aliases:
+            value = record.get(alias)
+            if value not in (None, ""):
+                break
+        values.append(value)
+    return values
+
+
+def validate(record):
+    """Turns raw (date, food_name, calories) values into a clean row, or raises ValueError."""
+    if record is None:
+        raise ValueError("malformed row")
+    raw_date, food_name, raw_calories = record
+    if raw_date in (None, ""):
+        raise ValueError("missing date")
+
+    day = str(raw_date).strip()[:10]
+    try:
+        parsed = date.fromisoformat(day)
+    except ValueError:
+        raise ValueError(f"bad date {str(raw_date)[:40]!r}") from None
+    if len(day) != 10:  # compact forms like 20260101
+        day = parsed.isoformat()
+
+    food_name = str(food_name).strip() if food_name is not None else ""
+    if not food_name:
+        raise ValueError("missing food_name")
+    if len(food_name) > MAX_NAME:
+        raise ValueError(f"food name over {MAX_NAME} characters")
+
+    if raw_calories in (None, ""):
+        raise ValueError("missing calories")
+    try:
+        calories = round(float(raw_calories))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"bad calories {str(raw_calories)[:40]!r}") from None
+    if not 0 <= calories <= MAX_CALORIES:
+        raise ValueError(f"calories {calories} outside 0-{MAX_CALORIES}")
+
+    return day, food_name, calories
+
+
+def read_csv(stream):
+    """Yields raw (date, food_name, calories) per CSV row; columns are found by header name, once."""
+    reader = csv.reader(stream)
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = []
+    for key, aliases in FIELDS.items():
+        found = [header.index(alias) for alias in aliases if alias in header]
+        if not found:
+            raise ValueError(f"CSV header has no {key} column (one of {', '.join(aliases)})")
+        columns.append(found[0])
+    date_column, name_column, calories_column = columns
+    width = max(columns)
+    for row in reader:
+        if len(row) > width:
+            yield row[date_column], row[name_column], row[calories_column]
+        elif row:
+            yield None
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield _pick(json.loads(line))
+
+
+_SKIP = re.compile(r"[\s,]*")
+
+
+def read_json(stream):
+    """Yields the elements of a top-level JSON array without loading the whole document. Falls back to JSON lines."""
+    decoder = json.JSONDecoder()
+    buffer = stream.read(READ_CHUNK).lstrip()
+    if not buffer.startswith("["):
+        yield from read_jsonl(_chain(buffer, stream))  # not an array: JSON lines
+        return
+
+    pos, eof = 1, False
+    while True:
+        pos = _SKIP.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            if pos == len(buffer):
+                raise json.JSONDecodeError("need more data", buffer, pos)
+            element, end = decoder.raw_decode(buffer, pos)
+            # A value that runs to the end of the buffer (e.g. a number) may be cut short.
+            if end == len(buffer) and not eof:
+                raise json.JSONDecodeError("need more data", buffer, pos)
+        except json.JSONDecodeError:
+            # Past MAX_ELEMENT the element is malformed, not incomplete; don't buffer the rest of the file.
+            if eof or len(buffer) - pos > MAX_ELEMENT:
+                raise ValueError("truncated or malformed JSON array") from None
+            chunk = stream.read(READ_CHUNK)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield _pick(element)
+        pos = end
+
+
+def _chain(head, stream):
+    """Lines of `head` followed by the rest of `stream`."""
+    yield from io.StringIO(head + stream.readline())
+    yield from stream
+
+
+READERS = {"csv": read_csv, "json": read_json, "jsonl": read_jsonl}
+
+
+def import_records(records, user_id, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Validates and inserts raw records (from READERS) for user_id. Invalid rows are
+    skipped and reported; a parse error stops the import but keeps the
+    batches already committed (each one with its aggregates). Returns a
+    report dict.
+    """
+    start = time.perf_counter()
+    report = {"imported": 0, "skipped": 0, "errors": []}
+    batch = []
+
+    def flush():
+        if batch and not dry_run:
+            database.add_food_logs(batch, user_id)
+        report["imported"] += len(batch)
+        batch.clear()
+
+    row_number = 0
+    try:
+        for row_number, record in enumerate(records, 1):
+            try:
+                batch.append(validate(record))
+            except ValueError as e:
+                report["skipped"] += 1
+                if len(report["errors"]) < MAX_ERRORS:
+                    report["errors"].append(f"row {row_number}: {e}")
+                continue
+            if len(batch) >= batch_size:
+                flush()
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:
+        report["error"] = f"stopped after row {row_number}: {e}"
+    flush()
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def import_stream(stream, user_id, fmt="csv", dry_run=False):
+    """Imports a text stream in one of FORMATS."""
+    return import_records(READERS[fmt](stream), user_id, dry_run=dry_run)
+
+
+def export_rows(user_id, start=None, end=None, fetch_size=FETCH_SIZE):
+    """
+    Yields (date, food_name, calories_in) for user_id in date order.
+    Uses its own connection, closed when the generator finishes, so a
+    StreamingResponse can iterate it from any thread.
+    """
+    conn = database.connect(check_same_thread=False)
+    try:
+        cursor = conn.execute("""
+            SELECT date, food_name, calories_in FROM daily_logs
+            WHERE user_id = ? AND date >= ? AND date <= ?
+            ORDER BY date, id
+        """, (user_id, start or "0000-00-00", end or "9999-12-31"))
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def write_csv(rows, chunk_rows=FETCH_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(("date", "food_name", "calories"))
+    for n, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if n % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_jsonl(rows, chunk_rows=FETCH_SIZE):
+    lines = []
+    for day, food_name, calories in rows:
+        lines.append(json.dumps({"date": day, "food_name": food_name, "calories": calories}, ensure_ascii=False))
+        if len(lines) >= chunk_rows:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def write_json(rows, chunk_rows=FETCH_SIZE):
+    yield "["
+    separator = "\n"
+    for chunk in write_jsonl(rows, chunk_rows):
+        yield separator + chunk.rstrip("\n").replace("\n", ",\n")
+        separator = ",\n"
+    yield "\n]\n"
+
+
+WRITERS = {"csv": write_csv, "json": write_json, "jsonl": write_jsonl}
+
+
+def export_chunks(user_id, fmt="csv", start=None, end=None):
+    """Encoded export chunks for user_id, ready to write or stream."""
+    for chunk in WRITERS[fmt](export_rows(user_id, start, end)):
+        yield chunk.encode("utf-8")
+
+
+def guess_format(path, default="csv"):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension == "ndjson":
+        return "jsonl"
+    return extension if extension in FORMATS else default
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import/export of food logs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import")
+    importer.add_argument("path", help="file to read, or - for stdin")
+    importer.add_argument("--dry-run", action="store_true", help="validate only")
+    exporter = commands.add_parser("export")
+    exporter.add_argument("path", nargs="?", default="-", help="file to write, or - for stdout")
+    exporter.add_argument("--start")
+    exporter.add_argument("--end")
+    for command in (importer, exporter):
+        command.add_argument("--sender", default="1", help="user sender identity (default: the local user)")
+        command.add_argument("--format", choices=FORMATS)
+    args = parser.parse_args()
+
+    database.migrate()  # progress goes to stderr, so `export -` writes nothing but the data
+    user_id = database.resolve_user_id(args.sender)
+    fmt = args.format or guess_format(args.path)
+
+    if args.command == "import":
+        if args.path == "-":
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+        else:
+            stream = open(args.path, encoding="utf-8-sig", newline="")
+        with stream:
+            report = import_stream(stream, user_id, fmt, dry_run=args.dry_run)
+        verb = "Validated" if args.dry_run else "Imported"
+        print(f"📥 {verb} {report['imported']} rows, skipped {report['skipped']} in {report['seconds']}s")
+        for error in report["errors"]:
+            print(f"  ⚠️  {error}")
+        if "error" in report:
+            print(f"❌ {report['error']}")
+            sys.exit(1)
+    else:
+        out = sys.stdout.buffer if args.path == "-" else open(args.path, "wb")
+        try:
+            for chunk in export_chunks(user_id, fmt, args.start, args.end):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+        if args.path != "-":
+            print(f"📤 Exported food logs to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
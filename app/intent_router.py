@@ -0,0 +1,72 @@
+"""
+Deterministic matcher for the handful of intents that don't need Gemini.
+
+Patterns must match the whole (normalised) message, so anything with extra
+content ("status, and I also had a dosa") falls through to the LLM.
+"""
+import re
+import threading
+
+_FILLER = r"(?:please |pls |hey |hi )?"
+_TAIL = r"(?: please| pls| now)?"
+
+_PATTERNS = [
+    ("status", re.compile(
+        rf"{_FILLER}(?:(?:show |check |get )?(?:my )?status(?: update)?(?: today)?"
+        r"|what'?s my status"
+        r"|how many (?:calories|kcal|cals) (?:do i have |have i got |are )?(?:left|remaining)(?: today| for today)?"
+        r"|(?:calories|kcal|cals) (?:left|remaining)(?: today)?"
+        rf"|dashboard){_TAIL}"
+    )),
+    ("history", re.compile(
+        rf"{_FILLER}(?:what(?:'?s| is| was) )?(?:my )?(?:average|avg)(?: calories| intake| kcal)?"
+        r" (?:over |for |in )?(?:the )?(?:last|past) (?P<n>\d+ )?(?P<unit>days?|weeks?)" + _TAIL
+    )),
+    ("reset", re.compile(
+        rf"{_FILLER}(?:reset(?: my)?(?: profile| everything)?|start over|start fresh){_TAIL}"
+    )),
+]
+
+_lock = threading.Lock()
+_counts = {"hits": 0, "misses": 0}
+
+
+def normalise(text):
+    text = text.lower().strip()
+    text = re.sub(r"[!?.,]+$", "", text)
+    return re.sub(r"\s+", " ", text)
+
+
+def match_intent(text):
+    """Returns (intent, args) for a recognised message, else None."""
+    message = normalise(text)
+    for intent, pattern in _PATTERNS:
+        found = pattern.fullmatch(message)
+        if not found:
+            continue
+        args = {}
+        if intent == "history":
+            n = int(found.group("n") or 1)
+            args["days"] = n * 7 if found.group("unit").startswith("week") else n
+        return intent, args
+    return None
+
+
+def record(intent):
+    """Counts a routing decision (intent None = fell through to the LLM) and logs the hit rate."""
+    with _lock:
+        if intent:
+            _counts["hits"] += 1
+            _counts[intent] = _counts.get(intent, 0) + 1
+        else:
+            _counts["misses"] += 1
+        total = _counts["hits"] + _counts["misses"]
+        rate = _counts["hits"] / total
+    if intent:
+        print(f"[Router] Fast path: {intent} (hit rate {rate:.0%} of {total})")
+
+
+def stats():
+    with _lock:
+        total = _counts["hits"] + _counts["misses"]
+        return dict(_counts, hit_rate=round(_counts["hits"] / total, 3) if total else 0.0)
@@ -1,66 +1,317 @@
 from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from langchain_core.messages import HumanMessage
+import hmac
+import io
 import logging
-from app.brain import agent_app
+import os
+import tempfile
+import time
+from app import database, fitbit_client, food_logs, metrics, outbox, services, media, nudge_gate, checkpoint_retention, context_window, intent_router, response_cache
+from app.brain import message_text
+from app.context_window import NO_NUDGE
+from app.dedup import MessageDeduper
+from app.work_queue import KeyedWorkQueue, QueueFull
 
 app = FastAPI()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn")
 
+# Graph turns run off the event loop; turns for one thread_id stay in order.
+turn_queue = KeyedWorkQueue()
+# Twilio retries slow webhooks; this makes each MessageSid run at most once.
+deduper = MessageDeduper()
+
+# Twilio signs webhooks with the URL it posted to; behind a proxy or tunnel set this to that public URL.
+WEBHOOK_URL = os.getenv("TWILIO_WEBHOOK_URL")
+
+# Bearer token for /food-logs/*; the endpoints are off unless it is set.
+FOOD_LOGS_TOKEN = os.getenv("FOOD_LOGS_TOKEN")
+FOOD_LOGS_MAX_BYTES = int(os.getenv("FOOD_LOGS_MAX_BYTES", 100 * 1024 * 1024))  # import body cap
+
+metrics.Gauge("nutriagent_queue", "Turn work queue counters.", ("field",),
+              lambda: {(field,): value for field, value in turn_queue.stats().items()})
+metrics.Gauge("nutriagent_fitbit_cache", "Fitbit reading cache counters, summed over users.", ("field",),
+              lambda: {(field,): value for field, value in fitbit_client.cache_stats().items()})
+metrics.Gauge("nutriagent_scheduler_gate", "Scheduled checks that ran the LLM vs. were skipped by the nudge gate.",
+              ("field",), lambda: {(field,): value for field, value in nudge_gate.stats().items()})
+metrics.Gauge("nutriagent_sqlite_lock", "SQLite write-lock contention since start.", ("field",),
+              lambda: {(field,): value for field, value in database.lock_stats().items()})
+
+def record_usage(messages):
+    """Sums token usage over the LLM replies of the turn that just ran (everything after the last human message)."""
+    prompt = completion = 0
+    for message in reversed(messages):
+        if message.type == "human":
+            break
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt += usage.get("input_tokens", 0)
+        completion += usage.get("output_tokens", 0)
+    if prompt or completion:
+        metrics.TURN_TOKENS.observe(prompt, "prompt")
+        metrics.TURN_TOKENS.observe(completion, "completion")
+
+def run_turn(thread_id, message_content, message_sid=None, kind="message"):
+    """Runs one blocking graph turn (called on a worker thread) and returns the reply text."""
+    config = {"configurable": {"thread_id": thread_id}}
+    try:
+        with metrics.span("graph turn", kind=kind), metrics.TURN_SECONDS.timer(kind):
+            result = services.graph().invoke(
+                {"messages": [HumanMessage(content=message_content)]},
+                config=config
+            )
+    except Exception:
+        if message_sid:
+            deduper.release(message_sid)
+        raise
+    record_usage(result["messages"])
+    reply = message_text(result["messages"][-1])
+    if message_sid:
+        deduper.complete(message_sid, reply)
+    return reply
+
+def run_message_turn(sender, user_message, image_url=None, message_sid=None, trace_context=None):
+    """Worker job for an incoming WhatsApp message; photos go through the media stage first."""
+    # The webhook's trace context is handed over explicitly: worker threads don't inherit it.
+    with metrics.span("message turn", trace_context, sender=sender, media=bool(image_url)):
+        reply = _message_turn(sender, user_message, image_url, message_sid)
+        deliver(sender, reply, message_sid)
+        return reply
+
+def deliver(destination, reply, source=None):
+    """Hands a reply to the outbox; without Twilio credentials (or for a non-WhatsApp thread) it is only logged."""
+    if not reply:
+        return
+    if outbox.ENABLED and database.is_whatsapp_sender(destination):
+        outbox.enqueue(destination, reply, source)
+    else:
+        logger.info(f"[*] Reply for {destination} (outbox disabled): {reply[:80]}")
+
+def _message_turn(sender, user_message, image_url, message_sid):
+    if not image_url:
+        return run_turn(sender, user_message, message_sid)
+
+    try:
+        with metrics.span("media"):
+            image = media.prepare_image(image_url, sender)
+    except Exception as e:
+        # Never hand the raw URL on: the model client would fetch it from this server.
+        logger.error(f"Media Error: {e}")
+        message_content = (
+            f"{user_message or 'Analyze this food.'}\n"
+            "[The user sent a food photo, but it could not be downloaded. Ask them to send it again or describe the food.]"
+        )
+        return run_turn(sender, message_content, message_sid)
+
+    if "analysis" in image:
+        logger.info(f"[*] Repeat photo {image['hash'][:12]}, reusing cached analysis.")
+        message_content = (
+            f"{user_message or 'Analyze this food.'}\n"
+            f"[The user sent a food photo you already analyzed earlier. Your analysis then was: {image['analysis']}]"
+        )
+        return run_turn(sender, message_content, message_sid, kind="photo_cached")
+
+    message_content = [
+        {"type": "text", "text": user_message or "Analyze this food."},
+        image["part"],
+    ]
+    start = time.perf_counter()
+    reply = run_turn(sender, message_content, message_sid, kind="photo")
+    media.record_analysis(image["hash"], reply, time.perf_counter() - start)
+    return reply
+
+def run_scheduled_check(thread_id, trace_context=None):
+    """Scheduler tick: only wakes the LLM if the user's state moved since the last nudge."""
+    with metrics.span("scheduled check", trace_context, sender=thread_id):
+        return _scheduled_check(thread_id)
+
+def _scheduled_check(thread_id):
+    user_id = database.resolve_user_id(thread_id)
+    reason, snapshot = nudge_gate.should_invoke(user_id)
+    if not reason:
+        logger.info(f"[*] Scheduler skip for {thread_id}: {'quiet hours' if snapshot is None else 'nothing changed'}.")
+        return None
+    logger.info(f"[*] Scheduler check for {thread_id}: {reason}.")
+    reply = run_turn(thread_id, "SCHEDULER_TRIGGER: Check status.", kind="scheduled")
+    nudge_gate.record_nudge(user_id, snapshot)
+    if NO_NUDGE in reply:
+        logger.info(f"[*] Scheduler check for {thread_id}: nothing worth sending.")
+        return None
+    deliver(thread_id, reply)
+    return reply
+
+@app.on_event("startup")
+def startup():
+    services.db()
+    removed = deduper.prune()
+    logger.info(f"[*] Pruned {removed} expired MessageSid records.")
+    checkpoint_retention.start_background_job(jobs=[deduper.prune])
+    if outbox.ENABLED:
+        outbox.sender.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    turn_queue.shutdown()
+    outbox.sender.stop()
+
 @app.get("/")
 def home():
-    return {"status": "NutriAgent is Awake 🟢"}
+    return {
+        "status": "NutriAgent is Awake 🟢",
+        "queue": turn_queue.stats(),
+        "dedup": deduper.stats(),
+        "scheduler_gate": nudge_gate.stats(),
+        "context": context_window.stats(),
+        "fast_path": intent_router.stats(),
+        "media": media.stats(),
+        "fitbit_cache": fitbit_client.cache_stats(),
+        "response_cache": response_cache.cache.stats(),
+        "db": database.lock_stats(),
+        "outbox": outbox.sender.stats(),
+    }
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape target."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def twiml_ack():
+    """Empty TwiML: Twilio sends nothing back to the user. Replies go out through the outbox."""
+    return Response("<Response/>", media_type="application/xml")
+
+def _signed_by_twilio(request, form_data):
+    """Checks X-Twilio-Signature. Without an auth token (local development) there is nothing to check against."""
+    if not outbox.AUTH_TOKEN:
+        return True
+    url = str(request.url)
+    if WEBHOOK_URL:
+        url = WEBHOOK_URL + (f"?{request.url.query}" if request.url.query else "")
+    return outbox.valid_signature(url, form_data.multi_items(), request.headers.get("X-Twilio-Signature"))
 
 @app.post("/whatsapp-webhook")
 async def whatsapp_reply(request: Request):
     """
     The Ear & Eye: Listens for Text AND Images from WhatsApp.
+    Acknowledges immediately; the turn itself runs on the work queue.
     """
     form_data = await request.form()
-    
+    if not _signed_by_twilio(request, form_data):
+        logger.warning("Rejected a webhook without a valid Twilio signature.")
+        return PlainTextResponse("Forbidden", status_code=403)
+
     user_message = form_data.get("Body", "").strip()
     sender = form_data.get("From", "Unknown")
-    
+    message_sid = form_data.get("MessageSid")
+
+    if message_sid:
+        # The claim is a SQLite write (and may wait on the busy timeout), so keep it off the event loop.
+        previous = await run_in_threadpool(deduper.claim, message_sid, sender)
+        if previous:
+            status, response = previous
+            logger.info(f"[*] Duplicate delivery {message_sid} ({status}, {len(response or '')} chars stored), skipping graph.")
+            return twiml_ack()
+
     image_url = form_data.get("MediaUrl0")
-    
+
     logger.info(f"[*] Incoming: '{user_message}' | Media: {1 if image_url else 0}")
 
     if image_url:
         print(f"[*] Vision Detected: {image_url}")
-        message_content = [
-            {"type": "text", "text": user_message or "Analyze this food."},
-            {"type": "image_url", "image_url": image_url}
-        ]
-    else:
-        message_content = user_message
-    
-    config = {"configurable": {"thread_id": sender}}
-    
+
     try:
-        agent_app.invoke(
-            {"messages": [HumanMessage(content=message_content)]}, 
-            config=config
-        )
-    except Exception as e:
-        logger.error(f"Brain Error: {e}")
+        with metrics.span("whatsapp webhook", sender=sender, message_sid=message_sid):
+            turn_queue.submit(sender, run_message_turn, sender, user_message, image_url, message_sid,
+                              metrics.capture_context())
+    except QueueFull as e:
+        logger.warning(f"Brain busy, rejecting message from {sender}: {e}")
+        if message_sid:
+            await run_in_threadpool(deduper.release, message_sid)
+        return PlainTextResponse("Busy", status_code=503)
 
-    return PlainTextResponse("OK")
+    return twiml_ack()
 
 @app.post("/trigger-agent")
-def trigger_agent():
+async def trigger_agent(sender: str = None):
     """
     The Alarm Clock: Wakes up the agent every 30 mins.
+    Checks one sender if given, otherwise every active WhatsApp user.
+    Answers 503 when the work queue rejected every check.
+    """
+
+    if sender:
+        senders = [sender]
+    else:
+        senders = [row[1] for row in await run_in_threadpool(database.get_active_users)]
+
+    triggered = skipped = 0
+    for thread_id in senders:
+        try:
+            turn_queue.submit(thread_id, run_scheduled_check, thread_id, metrics.capture_context())
+            triggered += 1
+        except QueueFull:
+            skipped += 1
+
+    if skipped:
+        logger.warning(f"Brain busy, skipped scheduled checks for {skipped} of {len(senders)} users.")
+    if senders and not triggered:
+        return JSONResponse({"status": "Agent Busy", "triggered": 0, "skipped": skipped}, status_code=503)
+    return {"status": "Agent Triggered", "triggered": triggered, "skipped": skipped}
+
+def _food_logs_denied(request, fmt):
+    """Error response for a /food-logs request that may not proceed, else None."""
+    if not FOOD_LOGS_TOKEN:
+        return PlainTextResponse("Food log import/export is disabled", status_code=404)
+    supplied = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(supplied, f"Bearer {FOOD_LOGS_TOKEN}".encode()):
+        return PlainTextResponse("Unauthorized", status_code=401)
+    if fmt not in food_logs.FORMATS:
+        return PlainTextResponse(f"format must be one of {', '.join(food_logs.FORMATS)}", status_code=400)
+    return None
+
+def _import_food_logs(stream, sender, fmt, dry_run):
+    return food_logs.import_stream(stream, database.resolve_user_id(sender), fmt, dry_run)
+
+@app.post("/food-logs/import")
+async def import_food_logs(request: Request, sender: str, format: str = "csv", dry_run: bool = False):
+    """
+    Bulk-imports a CSV / JSON array / JSON lines body into a sender's food history.
+    The body is spooled to a temp file as it arrives (up to FOOD_LOGS_MAX_BYTES),
+    then parsed in batches off the event loop.
     """
+    denied = _food_logs_denied(request, format)
+    if denied:
+        return denied
+    too_large = PlainTextResponse(f"Body over {FOOD_LOGS_MAX_BYTES} bytes", status_code=413)
+    length = request.headers.get("Content-Length", "")
+    if length.isdigit() and int(length) > FOOD_LOGS_MAX_BYTES:
+        return too_large
+    with tempfile.TemporaryFile() as body:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > FOOD_LOGS_MAX_BYTES:
+                return too_large
+            body.write(chunk)
+        body.seek(0)
+        stream = io.TextIOWrapper(body, encoding="utf-8-sig", newline="")
+        report = await run_in_threadpool(_import_food_logs, stream, sender, format, dry_run)
+        stream.detach()
+    logger.info(f"[*] Food log import for {sender}: {report['imported']} rows, {report['skipped']} skipped")
+    return report
 
-    user_id = "whatsapp:+919999999999" 
-    
-    config = {"configurable": {"thread_id": user_id}}
-    
-    agent_app.invoke(
-        {"messages": [HumanMessage(content="SCHEDULER_TRIGGER: Check status.")]}, 
-        config=config
+@app.get("/food-logs/export")
+def export_food_logs(request: Request, sender: str, format: str = "csv", start: str = None, end: str = None):
+    """Streams a sender's food history (optionally between start and end dates) as csv, json or jsonl."""
+    denied = _food_logs_denied(request, format)
+    if denied:
+        return denied
+    user_id = database.find_user_id(sender)
+    if user_id is None:
+        return PlainTextResponse("Unknown sender", status_code=404)
+    return StreamingResponse(
+        food_logs.export_chunks(user_id, format, start, end),
+        media_type=food_logs.CONTENT_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="food_logs.{format}"'},
     )
-    
-    return {"status": "Agent Triggered"}
\ No newline at end of file
@@ -0,0 +1,213 @@
+"""
+Media stage for WhatsApp photos.
+
+Downloads MediaUrl0 through a pooled session, downscales/recompresses it
+before it goes to Gemini, and keys the result by sender and content hash.
+If the same sender sends the same photo again, the analysis from the first
+time is reused and the image isn't sent to the model again. Analyses are
+never shared between senders: the reply carries that user's own goals and
+totals.
+
+The graph's HumanMessage carries only an IMAGE_REF part with the hash, so
+the photo isn't copied into every later checkpoint of the thread. The
+downscaled bytes are held in memory until the turn is done, and
+inline_images() swaps them in for that turn's own LLM calls.
+
+Only URLs under MEDIA_URL_PREFIX (Twilio's API host) are downloaded, and
+only those get the account credentials: MediaUrl0 comes from a webhook
+form, and anything else would leak the credentials or let a caller make
+the server fetch internal addresses.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import services
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it images are sent as downloaded.
+    Image = None
+
+MAX_SIDE = int(os.getenv("MEDIA_MAX_SIDE", 1024))
+JPEG_QUALITY = int(os.getenv("MEDIA_JPEG_QUALITY", 80))
+MAX_DOWNLOAD_BYTES = 15 * 1024 * 1024
+CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", ".media_cache")
+CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", 20 * 1024 * 1024))
+MAX_HELD_IMAGES = 64  # photos whose turn is queued or running
+IMAGE_REF = "image_ref"  # message part {"type": IMAGE_REF, "hash": ...}, resolved by inline_images()
+# Twilio media URLs start with this; requests drops the auth header on its redirect to the media host.
+MEDIA_URL_PREFIX = os.getenv("MEDIA_URL_PREFIX", "https://api.twilio.com/")
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=8))
+
+_lock = threading.Lock()
+_held = OrderedDict()  # hash -> data URL, oldest first
+_stats = {
+    "images": 0, "cache_hits": 0,
+    "bytes_downloaded": 0, "bytes_sent": 0,
+    "analysis_seconds": 0.0, "analyses": 0, "latency_saved_seconds": 0.0,
+}
+
+
+def _twilio_auth():
+    sid, token = os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN")
+    return (sid, token) if sid and token else None
+
+
+def is_twilio_media(url):
+    return isinstance(url, str) and url.startswith(MEDIA_URL_PREFIX)
+
+
+def download(url):
+    """Fetches the media bytes (Twilio media URLs need the account credentials). Other URLs raise ValueError."""
+    if not is_twilio_media(url):
+        raise ValueError(f"Not a Twilio media URL: {url[:80]!r}")
+    response = session.get(url, auth=_twilio_auth(), timeout=20, stream=True)
+    response.raise_for_status()
+    data = bytearray()
+    for chunk in response.iter_content(64 * 1024):
+        data.extend(chunk)
+        if len(data) > MAX_DOWNLOAD_BYTES:
+            raise ValueError("Image too large")
+    return bytes(data), response.headers.get("Content-Type", "image/jpeg")
+
+
+def downscale(data, content_type):
+    """Shrinks the longest side to MAX_SIDE and re-encodes as JPEG. Returns (bytes, mime)."""
+    if Image is None:
+        return data, content_type
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((MAX_SIDE, MAX_SIDE))
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    smaller = out.getvalue()
+    if len(smaller) >= len(data):
+        return data, content_type
+    return smaller, "image/jpeg"
+
+
+class AnalysisCache:
+    """Size-bounded on-disk LRU of {cache key: analysis text}. Recency is the file mtime."""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return entry.get("analysis")
+
+    def put(self, digest, analysis):
+        with open(self._path(digest), "w", encoding="utf-8") as f:
+            json.dump({"analysis": analysis, "created_at": time.time()}, f)
+        self._evict()
+
+    def _evict(self):
+        with _lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+
+
+def cache_key(owner, data):
+    """Per-sender key for a photo: the same image from two senders gets two entries."""
+    digest = hashlib.sha256(data).hexdigest()
+    return hashlib.sha256(f"{owner}:{digest}".encode()).hexdigest()
+
+
+def prepare_image(url, owner):
+    """
+    Returns a dict with the cache key `hash` and either `analysis` (cached
+    text from an earlier identical photo by the same owner) or `part`, an
+    IMAGE_REF message part for the downscaled image, held until
+    record_analysis().
+    """
+    data, content_type = download(url)
+    digest = cache_key(owner, data)
+    with _lock:
+        _stats["images"] += 1
+        _stats["bytes_downloaded"] += len(data)
+
+    analysis = services.media_cache().get(digest)
+    if analysis is not None:
+        with _lock:
+            _stats["cache_hits"] += 1
+            if _stats["analyses"]:
+                _stats["latency_saved_seconds"] += _stats["analysis_seconds"] / _stats["analyses"]
+        return {"hash": digest, "analysis": analysis}
+
+    small, mime = downscale(data, content_type)
+    with _lock:
+        _stats["bytes_sent"] += len(small)
+    encoded = base64.b64encode(small).decode()
+    with _lock:
+        _held[digest] = f"data:{mime};base64,{encoded}"
+        _held.move_to_end(digest)
+        while len(_held) > MAX_HELD_IMAGES:
+            _held.popitem(last=False)
+    return {"hash": digest, "part": {"type": IMAGE_REF, "hash": digest}}
+
+
+def inline_images(message):
+    """The message with IMAGE_REF parts replaced by the held image (or a note if it's gone)."""
+    if isinstance(message.content, str) or not any(
+        isinstance(part, dict) and part.get("type") == IMAGE_REF for part in message.content
+    ):
+        return message
+    content = []
+    for part in message.content:
+        if isinstance(part, dict) and part.get("type") == IMAGE_REF:
+            with _lock:
+                data_url = _held.get(part["hash"])
+            part = ({"type": "image_url", "image_url": data_url} if data_url else
+                    {"type": "text", "text": "[The photo is no longer available; ask the user to send it again.]"})
+        content.append(part)
+    return message.model_copy(update={"content": content})
+
+
+def record_analysis(digest, analysis, seconds):
+    """Stores the model's reply for a freshly analysed photo and lets go of its bytes."""
+    services.media_cache().put(digest, analysis)
+    with _lock:
+        _held.pop(digest, None)
+        _stats["analyses"] += 1
+        _stats["analysis_seconds"] += seconds
+
+
+def stats():
+    with _lock:
+        result = dict(_stats)
+    result["bytes_saved"] = result["bytes_downloaded"] - result["bytes_sent"]
+    return result
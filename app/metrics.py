@@ -0,0 +1,181 @@
+"""
+In-process latency/size histograms with Prometheus text exposition, plus
+optional trace spans.
+
+Histograms have fixed buckets and one lock each, so an observation is a
+bisect and two additions; cheap enough to leave on in production. All
+metrics are declared here and rendered by GET /metrics in app/main.py.
+
+Tracing is off unless NUTRIAGENT_TRACING=1 and opentelemetry-api is
+installed (exporters are configured the usual OpenTelemetry way, e.g.
+opentelemetry-instrument). Without it span() is a no-op.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import context as otel_context, trace
+except ImportError:  # tracing is optional; metrics work without it
+    trace = None
+
+TRACING = os.getenv("NUTRIAGENT_TRACING", "0") == "1" and trace is not None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [per-bucket counts..., overflow count, sum]
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def timer(self, *label_values):
+        """Context manager observing the elapsed seconds of its block."""
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from `collect()`, which returns {label values tuple: number}."""
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.collect is None:
+            return lines
+        for label_values, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+def render():
+    """The whole registry in Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+NODE_SECONDS = Histogram("nutriagent_node_seconds", "Graph node duration.", ("node",))
+LLM_SECONDS = Histogram("nutriagent_llm_seconds", "Gemini call latency.", ("call",))
+TURN_TOKENS = Histogram("nutriagent_turn_tokens", "Prompt/completion tokens per turn, summed over its LLM calls.",
+                        ("kind",), TOKEN_BUCKETS)
+TOOL_SECONDS = Histogram("nutriagent_tool_seconds", "Tool execution time.", ("tool", "status"))
+FITBIT_SECONDS = Histogram("nutriagent_fitbit_request_seconds", "Fitbit HTTP request latency.", ("endpoint",))
+FITBIT_RESPONSES = Counter("nutriagent_fitbit_responses_total", "Fitbit responses by status code.",
+                           ("endpoint", "status"))
+SQLITE_SECONDS = Histogram("nutriagent_sqlite_seconds", "SQLite statement time, lock waits included.",
+                           ("op",), QUERY_BUCKETS)
+CHECKPOINT_SECONDS = Histogram("nutriagent_checkpoint_seconds", "LangGraph checkpoint read/write time.",
+                               ("op",), QUERY_BUCKETS + (1,))
+TURN_SECONDS = Histogram("nutriagent_turn_seconds", "Whole graph turn, from worker start to reply.", ("kind",))
+OUTBOX_SEND_SECONDS = Histogram("nutriagent_outbox_send_seconds", "Twilio send latency by outcome.", ("outcome",))
+
+
+def capture_context():
+    """The current trace context, to hand to work that runs on another thread (or None)."""
+    return otel_context.get_current() if TRACING else None
+
+
+@contextmanager
+def span(name, context=None, **attributes):
+    """Starts a trace span (child of `context` if given). A no-op unless tracing is enabled."""
+    if not TRACING:
+        yield None
+        return
+    token = otel_context.attach(context) if context is not None else None
+    try:
+        with trace.get_tracer("nutriagent").start_as_current_span(
+            name, attributes={k: str(v) for k, v in attributes.items()}
+        ) as current:
+            yield current
+    finally:
+        if token is not None:
+            otel_context.detach(token)
@@ -0,0 +1,99 @@
+"""
+Cheap pre-check in front of scheduler-triggered turns.
+
+Each tick we build a small snapshot of what the coach would look at (goal,
+eaten today, Fitbit burned, time-of-day bucket, when we last nudged) from
+SQLite and the cached Fitbit reading. The LLM only runs when the snapshot
+moved past the configured thresholds since the last nudge. During quiet
+hours (GATE_QUIET_HOURS, server local time) nothing runs at all.
+"""
+import os
+import time
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from app import database
+from app.fitbit_client import get_client
+
+EATEN_DELTA = int(os.getenv("GATE_EATEN_DELTA", 150))     # kcal
+BURNED_DELTA = int(os.getenv("GATE_BURNED_DELTA", 150))   # kcal
+BUCKET_HOURS = int(os.getenv("GATE_BUCKET_HOURS", 4))     # morning / midday / evening...
+MAX_SKIP = int(os.getenv("GATE_MAX_SKIP_SECONDS", 4 * 3600))  # always look at least this often
+QUIET_START, QUIET_END = (int(hour) for hour in os.getenv("GATE_QUIET_HOURS", "22-7").split("-"))
+
+Snapshot = namedtuple("Snapshot", ["goal", "eaten", "burned", "bucket"])
+
+_lock = threading.Lock()
+_counters = {"invoked": 0, "skipped": 0, "quiet": 0}
+
+
+def is_quiet(hour):
+    """True inside [QUIET_START, QUIET_END), which may wrap past midnight. Equal bounds mean no quiet hours."""
+    if QUIET_START <= QUIET_END:
+        return QUIET_START <= hour < QUIET_END
+    return hour >= QUIET_START or hour < QUIET_END
+
+
+def current_snapshot(user_id):
+    # The day summary fetches sleep alongside calories, so a turn the gate lets
+    # through finds both already cached for get_health_status.
+    fitbit = get_client(user_id).get_day_summary()
+    return Snapshot(
+        goal=database.get_calorie_target(user_id),
+        eaten=database.get_eaten_today(user_id),
+        burned=fitbit["calories_burned"],
+        bucket=datetime.now().hour // BUCKET_HOURS,
+    )
+
+
+def _changed(previous, snapshot, last_nudge_at, now):
+    """Returns the reason the LLM should run, or None if nothing meaningful changed."""
+    if previous is None:
+        return "first check"
+    if snapshot.goal != previous.goal:
+        return "goal changed"
+    if snapshot.bucket != previous.bucket:
+        return "new time-of-day bucket"
+    if abs((snapshot.eaten or 0) - (previous.eaten or 0)) >= EATEN_DELTA:
+        return "eaten changed"
+    if abs((snapshot.burned or 0) - (previous.burned or 0)) >= BURNED_DELTA:
+        return "burned changed"
+    if last_nudge_at is None or now - last_nudge_at >= MAX_SKIP:
+        return "max skip reached"
+    return None
+
+
+def should_invoke(user_id):
+    """Returns (reason, snapshot). reason is None when the tick can be skipped."""
+    if is_quiet(datetime.now().hour):
+        with _lock:
+            _counters["quiet"] += 1
+        return None, None
+    snapshot = current_snapshot(user_id)
+    row = database.query_one(
+        "SELECT goal, eaten, burned, bucket, last_nudge_at FROM nudge_state WHERE user_id = ?", (user_id,)
+    )
+    previous = Snapshot(*row[:4]) if row else None
+    last_nudge_at = row[4] if row else None
+    reason = _changed(previous, snapshot, last_nudge_at, time.time())
+
+    with _lock:
+        _counters["invoked" if reason else "skipped"] += 1
+    return reason, snapshot
+
+
+def record_nudge(user_id, snapshot):
+    """Stores the snapshot the LLM just acted on as the new baseline."""
+    database.execute("""
+        INSERT INTO nudge_state (user_id, goal, eaten, burned, bucket, last_nudge_at) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET goal = excluded.goal, eaten = excluded.eaten, burned = excluded.burned,
+            bucket = excluded.bucket, last_nudge_at = excluded.last_nudge_at
+    """, (user_id, *snapshot, time.time()))
+
+
+def stats():
+    with _lock:
+        total = sum(_counters.values())
+        skipped = _counters["skipped"] + _counters["quiet"]
+        return dict(_counters, skip_rate=round(skipped / total, 3) if total else 0.0)
@@ -0,0 +1,294 @@
+"""
+Persistent outbox for WhatsApp replies.
+
+Turns call enqueue(), which only writes rows to the outbox table, so a
+slow or failing Twilio never holds up a turn and nothing is lost on a
+crash. A background OutboxSender claims due rows in batches and posts
+them from a bounded worker pool:
+
+- replies over 1600 characters are split into ordered parts, not cut;
+- each destination has at most one message in flight, parts go out in
+  order, and consecutive sends are spaced by DEST_INTERVAL seconds;
+- 429/5xx/network errors are retried with exponential backoff (honouring
+  Retry-After) up to MAX_ATTEMPTS; other 4xx fail immediately;
+- every row records its status (queued/sending/sent/failed), attempts,
+  Twilio sid and last error.
+
+Sending is enabled when the TWILIO_* credentials are set. TWILIO_API_BASE
+points it at a local fake (see benchmarks/fakes.py:TwilioStub).
+valid_signature() checks the X-Twilio-Signature of incoming webhooks
+with the same auth token.
+
+Usage: python -m app.outbox [stats|retry-failed|prune]
+"""
+import base64
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from app import database, metrics
+
+# The settings below are read at import, and app.main imports this module
+# before anything else has loaded .env.
+load_dotenv()
+
+ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+FROM_NUMBER = os.getenv("TWILIO_WHATSAPP_FROM")
+API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+ENABLED = bool(ACCOUNT_SID and AUTH_TOKEN and FROM_NUMBER)
+
+MAX_BODY = 1600  # Twilio's limit for a WhatsApp message body
+WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+DEST_INTERVAL = float(os.getenv("OUTBOX_DEST_INTERVAL", 1.0))  # seconds between sends to one number
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 6))
+RETRY_BACKOFF = 2.0  # seconds, doubled per attempt
+MAX_BACKOFF = 300
+POLL_INTERVAL = 1.0
+REQUEST_TIMEOUT = 10
+KEEP_SECONDS = 7 * 86400  # sent/failed rows kept this long for inspection
+
+
+def valid_signature(url, params, signature):
+    """
+    Twilio's webhook signature: HMAC-SHA1 (keyed by the auth token) of the
+    full request URL followed by every POST parameter as name+value, sorted
+    by name. `params` is a list of (name, value) pairs.
+    """
+    if not AUTH_TOKEN or not signature:
+        return False
+    payload = url + "".join(name + value for name, value in sorted(params))
+    digest = hmac.new(AUTH_TOKEN.encode(), payload.encode(), hashlib.sha1).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+
+def split_message(text, limit=MAX_BODY):
+    """Splits text into parts of at most `limit` chars, preferring paragraph, line, sentence, then word breaks."""
+    text = text.strip()
+    parts = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = limit
+        for separator in ("\n\n", "\n", ". ", " "):
+            found = window.rfind(separator)
+            if found > limit // 2:
+                cut = found + (1 if separator == ". " else 0)
+                break
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+def enqueue(destination, text, source=None):
+    """Queues `text` for `destination` (a whatsapp:+... address). Returns the new row ids."""
+    parts = split_message(text or "")
+    if not parts:
+        return []
+    now = time.time()
+    with database.transaction() as conn:
+        ids = [
+            conn.execute("""
+                INSERT INTO outbox (destination, body, part, parts, source, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (destination, body, number, len(parts), source, now, now)).lastrowid
+            for number, body in enumerate(parts, 1)
+        ]
+    sender.wake()
+    return ids
+
+
+def _claim(limit):
+    """Marks up to `limit` due head-of-line rows (oldest unsent per destination) as sending and returns them."""
+    with database.transaction() as conn:
+        rows = conn.execute("""
+            SELECT o.id, o.destination, o.body, o.attempts FROM outbox o
+            WHERE o.status = 'queued' AND o.next_attempt_at <= ?
+              AND o.id = (SELECT MIN(id) FROM outbox WHERE destination = o.destination AND status IN ('queued', 'sending'))
+            ORDER BY o.next_attempt_at LIMIT ?
+        """, (time.time(), limit)).fetchall()
+        conn.executemany("UPDATE outbox SET status = 'sending' WHERE id = ?", [(row[0],) for row in rows])
+    return rows
+
+
+def _mark_sent(row_id, destination, provider_sid):
+    now = time.time()
+    with database.transaction() as conn:
+        conn.execute(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, provider_sid = ?, last_error = NULL "
+            "WHERE id = ?", (now, provider_sid, row_id),
+        )
+        # Per-destination spacing lives in the table, so it holds across restarts.
+        conn.execute(
+            "UPDATE outbox SET next_attempt_at = MAX(next_attempt_at, ?) WHERE destination = ? AND status = 'queued'",
+            (now + DEST_INTERVAL, destination),
+        )
+
+
+def _mark_retry(row_id, attempts, error, retry_after=None):
+    if attempts >= MAX_ATTEMPTS:
+        _mark_failed(row_id, attempts, error)
+        return
+    delay = retry_after if retry_after is not None else min(RETRY_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+    database.execute(
+        "UPDATE outbox SET status = 'queued', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+        (attempts, time.time() + delay, error, row_id),
+    )
+
+
+def _mark_failed(row_id, attempts, error):
+    print(f"❌ [Outbox] Giving up on message {row_id} after {attempts} attempts: {error}")
+    database.execute(
+        "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+        (attempts, error, row_id),
+    )
+
+
+class OutboxSender:
+    """Background dispatcher: claims due rows in batches and sends them on a bounded pool."""
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._thread = None
+        self._executor = None
+        self.counts = {"sent": 0, "retried": 0, "failed": 0}
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        if self._thread:
+            return
+        # Rows left 'sending' by a crash are retried (at-least-once delivery).
+        database.execute("UPDATE outbox SET status = 'queued' WHERE status = 'sending'")
+        prune()
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbox")
+        self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        if not self._thread:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            with self._lock:
+                free = self.workers - self._in_flight
+            rows = []
+            if free > 0:
+                try:
+                    rows = _claim(free)
+                except Exception as e:
+                    print(f"[Outbox] Claim error: {e}")
+            for row in rows:
+                with self._lock:
+                    self._in_flight += 1
+                self._executor.submit(self._deliver, row)
+            if not rows:
+                self._wake.wait(POLL_INTERVAL)
+
+    def _deliver(self, row):
+        try:
+            self.send(row)
+        except Exception as e:
+            print(f"[Outbox] Error delivering {row[0]}: {e}")
+            try:
+                _mark_retry(row[0], row[3] + 1, str(e))  # don't leave it stuck in 'sending'
+            except Exception:
+                pass
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._wake.set()
+
+    def send(self, row):
+        row_id, destination, body, attempts = row
+        attempts += 1
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                f"{API_BASE}/2010-04-01/Accounts/{ACCOUNT_SID}/Messages.json",
+                data={"From": FROM_NUMBER, "To": destination, "Body": body},
+                auth=(ACCOUNT_SID, AUTH_TOKEN), timeout=REQUEST_TIMEOUT,
+            )
+        except requests.RequestException as e:
+            metrics.OUTBOX_SEND_SECONDS.observe(time.perf_counter() - start, "error")
+            self._count("retried")
+            _mark_retry(row_id, attempts, str(e))
+            return
+
+        if response.status_code in (200, 201):
+            metrics.OUTBOX_SEND_SECONDS.observe(time.perf_counter() - start, "sent")
+            self._count("sent")
+            _mark_sent(row_id, destination, response.json().get("sid"))
+        elif response.status_code == 429 or response.status_code >= 500:
+            metrics.OUTBOX_SEND_SECONDS.observe(time.perf_counter() - start, "retry")
+            self._count("retried")
+            retry_after = response.headers.get("Retry-After")
+            _mark_retry(row_id, attempts, f"HTTP {response.status_code}", float(retry_after) if retry_after else None)
+        else:
+            metrics.OUTBOX_SEND_SECONDS.observe(time.perf_counter() - start, "failed")
+            self._count("failed")
+            _mark_failed(row_id, attempts, f"HTTP {response.status_code}: {response.text[:200]}")
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def stats(self):
+        rows = database.query_all("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        with self._lock:
+            return {"enabled": ENABLED, "in_flight": self._in_flight, **self.counts,
+                    "rows": {status: count for status, count in rows}}
+
+
+def prune(keep=KEEP_SECONDS):
+    """Deletes sent/failed rows older than `keep` seconds. Returns the number removed."""
+    return database.execute(
+        "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?", (time.time() - keep,)
+    ).rowcount
+
+
+def retry_failed():
+    """Puts every failed row back in the queue. Returns the number requeued."""
+    return database.execute(
+        "UPDATE outbox SET status = 'queued', attempts = 0, next_attempt_at = ? WHERE status = 'failed'", (time.time(),)
+    ).rowcount
+
+
+sender = OutboxSender()
+
+
+if __name__ == "__main__":
+    database.init_db()
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "retry-failed":
+        print(f"Requeued {retry_failed()} failed messages.")
+    elif command == "prune":
+        print(f"Removed {prune()} old messages.")
+    else:
+        for key, value in sender.stats().items():
+            print(f"{key:12} {value}")
@@ -0,0 +1,110 @@
+"""
+Opt-in cache for meal-plan answers (RESPONSE_CACHE_ENABLED=1).
+
+Planning requests ("suggest a 1800 kcal Indian day plan") look alike across
+users with similar targets. Entries are bucketed by calorie band and prompt
+version, and looked up with a pluggable similarity matcher; the default is
+token-set Jaccard, which needs no model or network. Only turns where the
+LLM answered without calling any tool are ever stored, and anything that
+reads like "I ate/had ..." is never looked up, so food logging can't be
+served from here.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+TTL = int(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+CALORIE_BAND = 200
+SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.8))
+
+_PLANNING = re.compile(
+    r"\b(plan|planning|suggest|suggestion|ideas?|menu|recipes?|what (?:should|can|could) i (?:eat|have|cook)|diet chart)\b"
+)
+_ATE = re.compile(r"\b(i|we) (?:just )?(?:ate|had|have had|finished|drank|logged)\b|\blog\b")
+_STOPWORDS = {
+    "a", "an", "the", "me", "my", "i", "for", "of", "to", "and", "or", "please", "pls", "can", "you",
+    "could", "would", "give", "some", "with", "in", "on", "is", "it", "that", "this", "day", "today",
+}
+
+
+def is_planning_request(text):
+    text = text.lower()
+    return bool(_PLANNING.search(text)) and not _ATE.search(text)
+
+
+class TokenSetMatcher:
+    """Default matcher: normalised word set, compared with Jaccard similarity."""
+
+    def signature(self, text):
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        return frozenset(w for w in words if w not in _STOPWORDS)
+
+    def similarity(self, a, b):
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    def __init__(self, matcher=None, ttl=TTL, max_entries=MAX_ENTRIES, threshold=SIMILARITY_THRESHOLD):
+        self.matcher = matcher or TokenSetMatcher()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (bucket, signature) -> (response, stored_at)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def bucket(target, prompt_version):
+        band = (target or 0) // CALORIE_BAND * CALORIE_BAND
+        return (band, prompt_version)
+
+    def get(self, text, target, prompt_version):
+        bucket = self.bucket(target, prompt_version)
+        signature = self.matcher.signature(text)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, 0.0
+            for key, (_, stored_at) in list(self._entries.items()):
+                if now - stored_at > self.ttl:
+                    del self._entries[key]
+                    continue
+                if key[0] != bucket:
+                    continue
+                score = self.matcher.similarity(signature, key[1])
+                if score > best_score:
+                    best_key, best_score = key, score
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return self._entries[best_key][0]
+            self.misses += 1
+            return None
+
+    def put(self, text, target, prompt_version, response):
+        key = (self.bucket(target, prompt_version), self.matcher.signature(text))
+        with self._lock:
+            self._entries[key] = (response, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": ENABLED,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+cache = ResponseCache()
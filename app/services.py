@@ -0,0 +1,100 @@
+"""
+Process-wide singletons, built on first use instead of at import time.
+
+Importing app.brain used to migrate the DB, construct the Gemini client,
+bind tools, compile the graph and open the checkpointer connection, and
+each module built its own FitbitClient. Everything heavy now lives behind
+these accessors, so importing the app is cheap and every caller shares
+one instance of each service.
+"""
+import threading
+
+_lock = threading.RLock()  # re-entrant: graph() builds checkpointer() and db() under it
+_instances = {}
+
+
+def _get(name, factory):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = _instances[name] = factory()
+    return instance
+
+
+def db():
+    """The database module with migrations applied (connections are pooled per thread inside it)."""
+    def build():
+        from app import database
+        database.init_db()
+        return database
+    return _get("db", build)
+
+
+def llm():
+    def build():
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
+    return _get("llm", build)
+
+
+def llm_with_tools():
+    def build():
+        from app.brain import tools
+        return llm().bind_tools(tools)
+    return _get("llm_with_tools", build)
+
+
+def checkpointer():
+    def build():
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        from app import metrics
+
+        class TimedSaver(SqliteSaver):
+            """SqliteSaver with checkpoint reads and writes timed into nutriagent_checkpoint_seconds."""
+
+            def get_tuple(self, config):
+                with metrics.CHECKPOINT_SECONDS.timer("read"):
+                    return super().get_tuple(config)
+
+            def put(self, *args, **kwargs):
+                with metrics.CHECKPOINT_SECONDS.timer("write"):
+                    return super().put(*args, **kwargs)
+
+            def put_writes(self, *args, **kwargs):
+                with metrics.CHECKPOINT_SECONDS.timer("write_pending"):
+                    return super().put_writes(*args, **kwargs)
+
+        # The checkpointer keeps its own long-lived connection, opened with the same
+        # WAL/busy-timeout settings so it doesn't fight the tools for the write lock.
+        return TimedSaver(db().connect(check_same_thread=False))
+    return _get("checkpointer", build)
+
+
+def graph():
+    """The compiled LangGraph app."""
+    def build():
+        from app.brain import build_graph
+        db()
+        return build_graph().compile(checkpointer=checkpointer())
+    return _get("graph", build)
+
+
+def media_cache():
+    """The on-disk photo analysis cache (creates MEDIA_CACHE_DIR on first use)."""
+    def build():
+        from app.media import AnalysisCache
+        return AnalysisCache()
+    return _get("media_cache", build)
+
+
+def install(name, instance):
+    """Pre-seeds a service, e.g. a scripted LLM for the offline benchmarks."""
+    with _lock:
+        _instances[name] = instance
+
+
+def built():
+    """Names of the services constructed so far (used by the import-time check)."""
+    return sorted(_instances)
@@ -0,0 +1,87 @@
+"""
+Drop-in replacement for LangGraph's ToolNode that runs a turn's tool calls
+concurrently where it's safe.
+
+Calls are taken in the order Gemini emitted them. Consecutive read-only
+calls form a batch that runs on a thread pool; write tools run one at a
+time, in order, between batches. Identical read calls within a turn are
+executed once, and the memo is cleared after every write so later reads
+see its effect.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+
+from app import metrics
+
+MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", 4))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="tool")
+
+
+def _run(tool, call, config, trace_context=None):
+    start = time.perf_counter()
+    with metrics.span(f"tool {tool.name}", trace_context):
+        try:
+            result = str(tool.invoke(call["args"], config=config)), "success"
+        except Exception as e:
+            # Same shape ToolNode uses, so the LLM can see and recover from it.
+            result = f"Error: {e!r}\n Please fix your mistakes.", "error"
+    metrics.TOOL_SECONDS.observe(time.perf_counter() - start, tool.name, result[1])
+    return result
+
+
+def make_tool_node(tools, read_only):
+    """Builds the graph node. `read_only` is the set of tool names that never write."""
+    by_name = {t.name: t for t in tools}
+
+    def tool_node(state, config: RunnableConfig):
+        calls = state["messages"][-1].tool_calls
+        results = {}  # tool_call_id -> (content, status)
+        memo = {}     # (name, args) -> (content, status), reads only
+        start = time.perf_counter()
+        trace_context = metrics.capture_context()  # pool threads don't inherit it
+
+        def flush(batch):
+            pending = {}
+            for call in batch:
+                key = (call["name"], json.dumps(call["args"], sort_keys=True, default=str))
+                if key in memo:
+                    results[call["id"]] = memo[key]
+                elif key in pending:
+                    pending[key][1].append(call["id"])
+                else:
+                    future = _executor.submit(_run, by_name[call["name"]], call, config, trace_context)
+                    pending[key] = (future, [call["id"]])
+            for key, (future, ids) in pending.items():
+                memo[key] = future.result()
+                for call_id in ids:
+                    results[call_id] = memo[key]
+
+        batch = []
+        for call in calls:
+            if call["name"] not in by_name:
+                results[call["id"]] = (f"Error: {call['name']} is not a valid tool.", "error")
+            elif call["name"] in read_only:
+                batch.append(call)
+            else:
+                flush(batch)
+                batch = []
+                results[call["id"]] = _run(by_name[call["name"]], call, config)
+                memo.clear()
+        flush(batch)
+
+        if len(calls) > 1:
+            print(f"[Tools] {len(calls)} calls in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+        return {"messages": [
+            ToolMessage(content=results[call["id"]][0], name=call["name"], tool_call_id=call["id"],
+                        status=results[call["id"]][1])
+            for call in calls
+        ]}
+
+    return tool_node
@@ -2,11 +2,8 @@ import os
 import requests
 from dotenv import load_dotenv
 from langchain_core.tools import tool
-from app.fitbit_client import FitbitClient
-from app import database
-import sqlite3
-
-fitbit = FitbitClient()
+from app.fitbit_client import get_client
+from app import database, outbox
 
 load_dotenv()
 
@@ -61,53 +58,23 @@ load_dotenv()
 #         return "Food search failed (Check Console)."
 @tool
 def get_health_status():
-    """Use this tool to fetch the user's daily calorie goal and the live calories they have burned today from Fitbit."""
-    conn = sqlite3.connect(database.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT daily_calorie_target FROM users WHERE id = 1")
-    row = cursor.fetchone()
-    cursor.close()
-
-    target = row[0] if row in row[0] else 2000
+    """Use this tool to fetch the user's daily calorie goal and the live calories burned and sleep today from Fitbit."""
+    target = database.get_calorie_target() or 2000
 
-    burned = fitbit.get_calories_today()
+    fitbit = get_client(1).get_day_summary()
 
-    return f"User Target:{target} calories. Fitbit Calories Burned Today: {burned}."
+    return (f"User Target:{target} calories. Fitbit Calories Burned Today: {fitbit['calories_burned']}. "
+            f"Sleep Last Night: {fitbit['sleep_minutes']} minutes.")
 
-def send_whatsapp(message: str):
+def send_whatsapp(message: str, to: str = None):
     """
-    Mock Sender for Streamlit Testing.
-    Instead of calling Twilio, we just print.
+    Queues a WhatsApp message through the outbox (app/outbox.py), which
+    splits, rate-limits and retries it. Prints instead when Twilio isn't configured.
     """
     if not message: return
-    
-    print(f"\n[📱 MOCK WHATSAPP] {message}\n")
-    # """Sends a message via Twilio (Safe Mode)."""
-    # if not message or message.strip() == "":
-    #     return
-        
-    # # --- SAFETY CUT ---
-    # # WhatsApp Limit is 1600. We cut at 1500 to be safe.
-    # if len(message) > 1500:
-    #     print(f"[!] Warning: Message too long ({len(message)} chars). Truncating.")
-    #     message = message[:1500] + "...(message cut)"
-    # # ------------------
-    
-    # from twilio.rest import Client
-    
-    # account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    # auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-    # from_whatsapp = os.getenv("TWILIO_WHATSAPP_FROM") 
-    # to_whatsapp = os.getenv("MY_PHONE_NUMBER")        
-    
-    # client = Client(account_sid, auth_token)
-    
-    # try:
-    #     client.messages.create(
-    #         body=message,
-    #         from_=from_whatsapp,
-    #         to=to_whatsapp
-    #     )
-    #     print(f"[*] WhatsApp Sent: {message[:30]}...")
-    # except Exception as e:
-    #     print(f"[!] Twilio Error: {e}")
\ No newline at end of file
+    to = to or os.getenv("MY_PHONE_NUMBER")
+
+    if not outbox.ENABLED or not to:
+        print(f"\n[📱 MOCK WHATSAPP] {message}\n")
+        return
+    outbox.enqueue(to, message)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("uvicorn")
+
+# Graph turns are blocking (Gemini, Fitbit, SQLite), so they run on threads.
+MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", 8))
+# Back-pressure: beyond these we refuse new work instead of queueing forever.
+MAX_PENDING = int(os.getenv("AGENT_MAX_PENDING", 200))
+MAX_PENDING_PER_KEY = int(os.getenv("AGENT_MAX_PENDING_PER_SENDER", 10))
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the queue is over its back-pressure limits."""
+
+
+class KeyedWorkQueue:
+    """
+    Runs blocking jobs on a bounded thread pool while keeping jobs that share
+    a key (a conversation thread_id) strictly in submission order. Different
+    keys run in parallel, up to max_workers at a time.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING, max_pending_per_key=MAX_PENDING_PER_KEY):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        self.max_pending = max_pending
+        self.max_pending_per_key = max_pending_per_key
+        self._queues = {}   # key -> deque of (fn, args, future)
+        self._tasks = set()  # strong refs so drain tasks aren't garbage collected
+        self._pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, key, fn, *args):
+        """Queues fn(*args) behind any earlier work for `key`. Returns an asyncio future for its result."""
+        queue = self._queues.get(key)
+        if self._pending >= self.max_pending or (queue and len(queue) >= self.max_pending_per_key):
+            self.rejected += 1
+            raise QueueFull(f"Work queue full (pending={self._pending})")
+
+        future = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = self._queues[key] = deque()
+            queue.append((fn, args, future))
+            task = asyncio.create_task(self._drain(key, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            queue.append((fn, args, future))
+        self._pending += 1
+        return future
+
+    async def _drain(self, key, queue):
+        loop = asyncio.get_running_loop()
+        while queue:
+            fn, args, future = queue[0]
+            try:
+                result = await loop.run_in_executor(self.executor, fn, *args)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Worker error for {key}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+                    # Already logged; don't warn again if nobody awaits it.
+                    future.exception()
+            else:
+                self.completed += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                queue.popleft()
+                self._pending -= 1
+        del self._queues[key]
+
+    def stats(self):
+        return {
+            "pending": self._pending,
+            "active_senders": len(self._queues),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,83 @@
+"""
+Compares the old connect-per-call pattern against the pooled WAL layer in
+app/database.py on a log_food + get_health_status style workload.
+
+Usage: python -m benchmarks.db_bench [ops] [threads]
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+
+from app import database
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS daily_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT, user_id INTEGER, food_name TEXT, calories_in INTEGER
+    )
+'''
+INSERT = "INSERT INTO daily_logs (date, user_id, food_name, calories_in) VALUES (date('now', 'localtime'), 1, ?, ?)"
+TOTAL = "SELECT IFNULL(SUM(calories_in), 0) FROM daily_logs WHERE user_id = 1 AND date = date('now', 'localtime')"
+
+
+def naive_op(path, i):
+    conn = sqlite3.connect(path)
+    conn.execute(INSERT, (f"food {i}", 100))
+    conn.commit()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute(TOTAL).fetchone()
+    conn.close()
+
+
+def pooled_op(path, i):
+    database.execute(INSERT, (f"food {i}", 100))
+    database.query_one(TOTAL)
+
+
+def run(op, path, ops, threads):
+    per_thread = ops // threads
+
+    def worker():
+        for i in range(per_thread):
+            op(path, i)
+        database.close_connection()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        naive_path = os.path.join(tmp, "naive.db")
+        conn = sqlite3.connect(naive_path)
+        conn.execute(SCHEMA)
+        conn.close()
+
+        database.DB_PATH = os.path.join(tmp, "pooled.db")
+        database.execute(SCHEMA)
+        database.close_connection()
+
+        naive = run(naive_op, naive_path, ops, threads)
+        pooled = run(pooled_op, database.DB_PATH, ops, threads)
+
+    print(f"ops={ops} threads={threads}")
+    print(f"connect-per-call : {naive:10.0f} ops/sec")
+    print(f"pooled WAL layer : {pooled:10.0f} ops/sec")
+    print(f"speedup          : {pooled / naive:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
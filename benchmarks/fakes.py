@@ -0,0 +1,306 @@
+"""
+Offline stand-ins for the services NutriAgent talks to, so benchmarks run
+without Gemini or Fitbit accounts:
+
+- ScriptedChatModel: a deterministic chat model that replays scripted tool
+  calls keyed on the user's message, then answers with plain text.
+- FitbitStub: a local HTTP server answering the Fitbit endpoints used by
+  FitbitClient, with optional artificial latency and scripted 401/429/5xx
+  failures.
+- MediaStub: serves generated PNGs in place of Twilio media URLs.
+- TwilioStub: accepts outbox sends, with injectable 503s and 429s.
+"""
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app import database, food_index
+
+# keyword in the user's message -> steps; each step is the list of tool calls
+# for one LLM round, and the final reply comes after the last step.
+DEFAULT_SCRIPT = [
+    ("idli", [[("log_food", {"food_name": "idli", "servings": 2}), ("log_food", {"food_name": "sambar"})]]),
+    ("fitbit", [[("get_fitbit_history", {"days": 7})]]),
+    ("doing", [[("get_health_status", {}), ("get_historical_summary", {"days": 7})]]),
+    ("SCHEDULER_TRIGGER", [[("get_health_status", {})]]),
+    ("weigh", [[("update_profile", {"weight": 72.5, "target_calories": 2100})]]),
+]
+
+# Messages a benchmark cycles through; together they hit every tool path.
+DEFAULT_TURNS = [
+    "I had 2 idli and sambar for breakfast",
+    "How did my fitbit stats look this week?",
+    "How am I doing so far?",
+    "Suggest a high protein dinner plan",
+    "I weigh 72.5 kg now and want 2100 kcal a day",
+]
+
+
+def _text(message):
+    if isinstance(message.content, str):
+        return message.content
+    return " ".join(block.get("text", "") for block in message.content if isinstance(block, dict))
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Replays DEFAULT_SCRIPT (or `script`). `latency` seconds are slept per call to model the API."""
+
+    script: list = DEFAULT_SCRIPT
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    def _respond(self, messages):
+        # The rolling-summary call has no human turn of its own to script.
+        if messages[0].type == "system" and "running summary" in _text(messages[0]):
+            return AIMessage(content="Summary: user logs Indian breakfasts and checks Fitbit weekly.")
+
+        human_index = max(i for i, m in enumerate(messages) if m.type == "human")
+        prompt = _text(messages[human_index])
+        rounds = sum(1 for m in messages[human_index + 1:] if m.type == "ai")
+
+        steps = next((steps for keyword, steps in self.script if keyword.lower() in prompt.lower()), [])
+        if rounds < len(steps):
+            return AIMessage(content="", tool_calls=[
+                {"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}
+                for name, args in steps[rounds]
+            ])
+        results = " | ".join(_text(m) for m in messages[human_index + 1:] if m.type == "tool")
+        return AIMessage(content=f"Got it. {results}" if results else "Try paneer tikka with a big salad (~550 kcal).")
+
+
+class StubServer:
+    """
+    Minimal threaded HTTP server on 127.0.0.1 for canned responses. Subclasses
+    implement respond(method, path, body) -> (status, headers, payload bytes).
+    `requests` counts calls by method and path shape (dates and ids masked).
+    """
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.requests = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b""
+                stub._count(self.command, self.path)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, headers, payload = stub.respond(self.command, self.path, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def respond(self, method, path, body):
+        raise NotImplementedError
+
+    def _count(self, method, path):
+        shape = re.sub(r"\d+(?=\.)", "N", re.sub(r"\d{4}-\d{2}-\d{2}", "{date}", path))
+        with self._lock:
+            self.requests[f"{method} {shape}"] = self.requests.get(f"{method} {shape}", 0) + 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FitbitStub(StubServer):
+    """
+    Canned Fitbit API. Point FitbitClient at `url` (base_url= or app.fitbit_client.API_BASE).
+    `fail(*statuses)` makes the next GETs answer with those statuses, in
+    order: 401 as an expired token, 429 with a `retry_after` Retry-After
+    header, anything else as a server error.
+    """
+
+    RATE_LIMIT_HEADERS = {
+        "Fitbit-Rate-Limit-Limit": "150",
+        "Fitbit-Rate-Limit-Remaining": "150",
+        "Fitbit-Rate-Limit-Reset": "3600",
+    }
+
+    def __init__(self, retry_after="1", **kwargs):
+        super().__init__(**kwargs)
+        self.retry_after = retry_after
+        self._failures = []
+
+    def fail(self, *statuses):
+        with self._lock:
+            self._failures.extend(statuses)
+        return self
+
+    def respond(self, method, path, body):
+        if method == "POST":
+            data = {"access_token": "stub-access", "refresh_token": "stub-refresh", "expires_in": 28800}
+        else:
+            with self._lock:
+                status = self._failures.pop(0) if self._failures else None
+            if status == 401:
+                return 401, {"Content-Type": "application/json"}, b'{"errors": [{"errorType": "expired_token"}]}'
+            if status == 429:
+                return 429, {"Retry-After": self.retry_after}, b'{"errors": [{"errorType": "rate_limit"}]}'
+            if status:
+                return status, {}, b'{"errors": [{"errorType": "system"}]}'
+            data = fitbit_response(path)
+        headers = dict(self.RATE_LIMIT_HEADERS, **{"Content-Type": "application/json"})
+        return 200, headers, json.dumps(data).encode()
+
+
+class MediaStub(StubServer):
+    """Serves GET /media/<n>.png as a distinct, valid PNG per n (stands in for Twilio media URLs)."""
+
+    def __init__(self, size=640, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self._images = {}
+
+    def respond(self, method, path, body):
+        found = re.fullmatch(r"/media/(\d+)\.png", path)
+        if not found:
+            return 404, {}, b""
+        n = int(found.group(1))
+        with self._lock:
+            if n not in self._images:
+                self._images[n] = png(self.size, self.size, seed=n)
+            image = self._images[n]
+        return 200, {"Content-Type": "image/png"}, image
+
+
+class TwilioStub(StubServer):
+    """
+    Fake Twilio Messages API (POST /2010-04-01/Accounts/<sid>/Messages.json).
+    Accepted messages are appended to `messages` as (monotonic time, To, Body).
+    Every `fail_every`-th request gets a 503 and every `throttle_every`-th a
+    429 with Retry-After, to exercise retries; bodies over 1600 chars get
+    Twilio's 400 (error 21617).
+    """
+
+    def __init__(self, fail_every=0, throttle_every=0, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_every = fail_every
+        self.throttle_every = throttle_every
+        self.messages = []
+        self._seen = 0
+
+    def respond(self, method, path, body):
+        if method != "POST" or not re.fullmatch(r"/2010-04-01/Accounts/[^/]+/Messages\.json", path):
+            return 404, {}, b""
+        form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        with self._lock:
+            self._seen += 1
+            seen = self._seen
+        if self.fail_every and seen % self.fail_every == 0:
+            return 503, {}, b""
+        if self.throttle_every and seen % self.throttle_every == 0:
+            return 429, {"Retry-After": "1"}, b""
+        if len(form.get("Body", "")) > 1600:
+            error = {"code": 21617, "message": "The concatenated message body exceeds the 1600 character limit."}
+            return 400, {"Content-Type": "application/json"}, json.dumps(error).encode()
+
+        with self._lock:
+            self.messages.append((time.monotonic(), form.get("To"), form.get("Body")))
+        reply = {"sid": f"SM{uuid.uuid4().hex}", "status": "queued", "to": form.get("To"), "body": form.get("Body")}
+        return 201, {"Content-Type": "application/json"}, json.dumps(reply).encode()
+
+
+def png(width, height, seed=0):
+    """A noisy RGB PNG built with zlib only, so no imaging library is needed."""
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+BUNDLED_FOODS = os.path.join(os.path.dirname(__file__), "..", "data", "foods.csv")
+
+
+def load_bundled_foods():
+    """Loads the nutrition table the README setup loads, so log_food finds common foods."""
+    return food_index.load_csv(BUNDLED_FOODS)
+
+
+def onboard_user(sender):
+    """Creates an onboarded user whose Fitbit tokens the stub accepts. Returns the thread config."""
+    user_id = database.resolve_user_id(sender)
+    database.update_profile(72.0, 2000, user_id)
+    database.update_token("stub-access", "stub-refresh", time.time() + 86400, user_id)
+    return {"configurable": {"thread_id": sender}}
+
+
+def _days(start, end):
+    day, last = date.fromisoformat(start), date.fromisoformat(end)
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def fitbit_response(path):
+    """Canned JSON for the Fitbit paths FitbitClient requests."""
+    dates = re.findall(r"\d{4}-\d{2}-\d{2}", path)
+    if len(dates) == 2:
+        days = list(_days(*dates))
+        if "/activityCalories/" in path:
+            return {"activities-activityCalories": [{"dateTime": d, "value": "540"} for d in days]}
+        if "/heart/" in path:
+            return {"activities-heart": [{"dateTime": d, "value": {"restingHeartRate": 61}} for d in days]}
+        if "/sleep/" in path:
+            return {"sleep": [{"dateOfSleep": d, "minutesAsleep": 410} for d in days]}
+    if "/sleep/" in path:
+        return {"summary": {"totalMinutesAsleep": 410}}
+    if "/activities/" in path:
+        return {"summary": {"activityCalories": 540}}
+    return {}
@@ -0,0 +1,70 @@
+"""
+Check of FitbitClient's failure handling against the fake Fitbit API.
+
+Each case scripts the stub's next responses (401, 429 with different
+Retry-After values, 5xx) and reads today's activity calories through a
+fresh client. The read must come back with the stub's value (or 0 once
+retries run out) without raising, refreshing the token once on a 401.
+
+Usage: python -m benchmarks.fitbit_check
+"""
+import os
+import sys
+import tempfile
+import time
+
+from app import database, fitbit_client
+from benchmarks.fakes import FitbitStub, onboard_user
+
+CALORIES = 540  # what the stub reports for today's activity
+REFRESH = "POST /oauth2/token"
+
+# (name, statuses for the next GETs, Retry-After header, expected value, expected token refreshes)
+CASES = [
+    ("401 refreshes the token once", [401], "1", CALORIES, 1),
+    ("429 with Retry-After seconds", [429], "0", CALORIES, 0),
+    ("429 with an HTTP-date Retry-After", [429], "Wed, 21 Oct 2015 07:28:00 GMT", CALORIES, 0),
+    ("429 with a malformed Retry-After", [429], "soon", CALORIES, 0),
+    ("5xx is retried", [503, 502], "1", CALORIES, 0),
+    ("5xx past MAX_RETRIES serves 0", [500] * (fitbit_client.MAX_RETRIES + 1), "1", 0, 0),
+]
+
+
+def run_case(stub, user_id, statuses, retry_after):
+    stub.retry_after = retry_after
+    stub.fail(*statuses)
+    before = stub.requests.get(REFRESH, 0)
+    start = time.perf_counter()
+    value = fitbit_client.FitbitClient(user_id, base_url=stub.url).get_calories_today()
+    return value, stub.requests.get(REFRESH, 0) - before, time.perf_counter() - start
+
+
+def main():
+    fitbit_client.RETRY_BACKOFF = 0.01
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp, FitbitStub() as stub:
+        database.DB_PATH = os.path.join(tmp, "fitbit.db")
+        database.init_db()
+        user_id = database.resolve_user_id(onboard_user("whatsapp:+15550000001")["configurable"]["thread_id"])
+
+        for name, statuses, retry_after, expected, refreshes in CASES:
+            try:
+                value, refreshed, seconds = run_case(stub, user_id, statuses, retry_after)
+            except Exception as e:
+                failures.append(f"{name}: raised {e!r}")
+                continue
+            print(f"  {name:40s} -> {value} in {seconds * 1000:.0f}ms, {refreshed} refresh(es)")
+            if value != expected:
+                failures.append(f"{name}: got {value}, expected {expected}")
+            if refreshed != refreshes:
+                failures.append(f"{name}: {refreshed} token refreshes, expected {refreshes}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Fitbit 401/429/5xx paths recover as expected.")
+
+
+if __name__ == "__main__":
+    main()
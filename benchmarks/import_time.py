@@ -0,0 +1,90 @@
+"""
+Import-time check for the web app. Imports app.main in a fresh interpreter
+with -X importtime, prints the slowest modules, and fails if the total
+exceeds IMPORT_BUDGET_MS or if importing built any service (LLM client,
+graph, checkpointer, DB migration) that should wait until first use.
+
+Measured 2026-10-18, Python 3.11.7 on one vCPU, with fastapi 0.143.0,
+langgraph 1.2.15, langchain-core 1.6.10 and langchain-google-genai 4.4.2
+(deferred) installed: ten runs of `import app.main` took 1434-1782ms,
+median ~1610ms. Most of it is langgraph.graph (~700ms, via app.brain)
+and fastapi (~400ms). The default budget leaves ~25% over that median.
+
+Usage: python -m benchmarks.import_time [module]
+"""
+import os
+import subprocess
+import sys
+
+BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 2000))
+TOP = 15
+# Heavy modules that must only be imported when the LLM is first used.
+DEFERRED_MODULES = ("langchain_google_genai", "google.genai", "google.generativeai")
+
+PROBE = """
+import sys, {module}
+from app import services
+print("BUILT=" + ",".join(services.built()))
+print("LOADED=" + ",".join(m for m in {deferred!r} if m in sys.modules))
+"""
+
+
+def measure(module="app.main"):
+    """Returns (total_ms, [(cumulative_ms, module)], built_services, loaded_deferred_modules)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, deferred=DEFERRED_MODULES)],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "import failed")
+
+    timings = []
+    total = 0.0
+    # The target and its parent packages (e.g. app, app.main): their top-level rows'
+    # cumulative times are the whole import. Interpreter startup rows are not counted.
+    targets = {".".join(module.split(".")[:i]) for i in range(1, module.count(".") + 2)}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"; nesting indents the name by 2 per level.
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        ms = int(cumulative) / 1000
+        if name.startswith(" ") and not name.startswith("  ") and name.strip() in targets:
+            total += ms
+        timings.append((ms, name.strip()))
+
+    fields = dict(line.split("=", 1) for line in result.stdout.splitlines() if "=" in line)
+    built = [s for s in fields.get("BUILT", "").split(",") if s]
+    loaded = [m for m in fields.get("LOADED", "").split(",") if m]
+    return total, sorted(timings, reverse=True), built, loaded
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "app.main"
+    try:
+        total, timings, built, loaded = measure(module)
+    except RuntimeError as e:
+        print(f"❌ import {module} failed: {e}")
+        sys.exit(1)
+
+    print(f"📦 import {module}: {total:.0f}ms (budget {BUDGET_MS:.0f}ms)")
+    for ms, name in timings[:TOP]:
+        print(f"  {ms:8.1f}ms  {name.strip()}")
+
+    failures = []
+    if total > BUDGET_MS:
+        failures.append(f"import took {total:.0f}ms, over the {BUDGET_MS:.0f}ms budget")
+    if built:
+        failures.append(f"services built at import time: {', '.join(built)}")
+    if loaded:
+        failures.append(f"deferred modules imported eagerly: {', '.join(loaded)}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Import time within budget, nothing built eagerly.")
+
+
+if __name__ == "__main__":
+    main()
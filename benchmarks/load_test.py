@@ -0,0 +1,290 @@
+"""
+Load generator for the FastAPI app. Replays Twilio-style WhatsApp form
+posts (text and MediaUrl0 photos) to /whatsapp-webhook, mixed with
+/trigger-agent ticks, from N simulated senders at a fixed arrival rate.
+
+By default the app runs in-process under uvicorn against a throwaway DB,
+with the scripted LLM and the Fitbit/media stubs from benchmarks.fakes, so
+the numbers measure this codebase rather than Gemini. Arrivals are
+open-loop (sent on schedule whatever earlier responses did) and latency is
+measured from the scheduled send time, so a blocked event loop shows up in
+the percentiles instead of quietly lowering the send rate.
+
+Reports throughput, p50/p95/p99 for webhook acks and completed turns,
+error rates and SQLite lock waits (from the app's `/` stats).
+
+Usage: python -m benchmarks.load_test [--senders 50] [--rate 20] [--duration 30]
+                                      [--photo-ratio 0.2] [--trigger-ratio 0.05]
+                                      [--llm-latency-ms 500] [--fitbit-latency-ms 100]
+                                      [--url http://host:8000] [--out path]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks.fakes import DEFAULT_TURNS, FitbitStub, MediaStub, ScriptedChatModel, load_bundled_foods, onboard_user
+from benchmarks.offline_bench import summarize
+
+POLL_INTERVAL = 0.05  # seconds between checks for finished turns
+PHOTO_POOL = 5        # repeat photos are drawn from this many images
+
+
+def sender_id(i):
+    return f"whatsapp:+1555{i:07d}"
+
+
+def build_schedule(args, media_url):
+    """Returns [(offset_seconds, kind, params_or_form)] for the whole run, deterministic per --seed."""
+    rng = random.Random(args.seed)
+    total = int(args.rate * args.duration)
+    schedule = []
+    for n in range(total):
+        sender = sender_id(rng.randrange(args.senders))
+        if rng.random() < args.trigger_ratio:
+            schedule.append((n / args.rate, "trigger", {"sender": sender}))
+            continue
+
+        sid = f"SM{uuid.UUID(int=rng.getrandbits(128)).hex}"
+        form = {
+            "SmsMessageSid": sid, "SmsSid": sid, "MessageSid": sid,
+            "AccountSid": "ACloadtest", "ApiVersion": "2010-04-01", "NumSegments": "1",
+            "From": sender, "To": "whatsapp:+14155238886",
+            "WaId": sender.split("+")[1], "ProfileName": f"Load {sender[-4:]}",
+            "Body": rng.choice(DEFAULT_TURNS), "NumMedia": "0",
+        }
+        if media_url and rng.random() < args.photo_ratio:
+            image = rng.randrange(PHOTO_POOL) if rng.random() < args.repeat_photo_ratio else PHOTO_POOL + n
+            form.update({"Body": "", "NumMedia": "1", "MediaUrl0": f"{media_url}/media/{image}.png",
+                         "MediaContentType0": "image/png"})
+        schedule.append((n / args.rate, "photo" if "MediaUrl0" in form else "message", form))
+    return schedule
+
+
+class TurnTracker:
+    """Polls processed_messages to see when each accepted MessageSid's turn finished."""
+
+    def __init__(self):
+        self.sent = {}      # sid -> scheduled send time (perf_counter)
+        self.finished = {}  # sid -> seconds from scheduled send to observed completion
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def expect(self, sid, scheduled):
+        with self._lock:
+            self.sent[sid] = scheduled
+
+    def pending(self):
+        with self._lock:
+            return [sid for sid in self.sent if sid not in self.finished]
+
+    def _poll(self):
+        from app import database
+        while not self._stop.wait(POLL_INTERVAL):
+            waiting = self.pending()
+            for start in range(0, len(waiting), 500):
+                chunk = waiting[start:start + 500]
+                rows = database.query_all(
+                    f"SELECT message_sid FROM processed_messages WHERE status = 'done' "
+                    f"AND message_sid IN ({','.join('?' * len(chunk))})", chunk,
+                )
+                now = time.perf_counter()
+                with self._lock:
+                    for (sid,) in rows:
+                        self.finished[sid] = now - self.sent[sid]
+        database.close_connection()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def start_app(args, directory, media_stub):
+    """Runs app.main:app under uvicorn in this process, wired to the fakes. Returns (url, stop)."""
+    import uvicorn
+    from app import database, fitbit_client, media, nudge_gate, outbox, services
+
+    database.DB_PATH = os.path.join(directory, "load.db")
+    fitbit = FitbitStub(latency=args.fitbit_latency_ms / 1000).start()
+    fitbit_client.API_BASE = fitbit.url
+    services.install("media_cache", media.AnalysisCache(os.path.join(directory, "media")))
+    media.MEDIA_URL_PREFIX = f"{media_stub.url}/media/"
+    # Credentials from .env must not send real messages or demand real webhook signatures here.
+    outbox.ENABLED, outbox.AUTH_TOKEN = False, None
+    nudge_gate.QUIET_START = nudge_gate.QUIET_END = 0  # same numbers whatever the time of day
+    services.install("llm", ScriptedChatModel(latency=args.llm_latency_ms / 1000))
+    services.db()
+    load_bundled_foods()
+    for i in range(args.senders):
+        onboard_user(sender_id(i))
+
+    from app.main import app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            sys.exit("❌ uvicorn failed to start")
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+        fitbit.stop()
+        services.checkpointer().conn.close()
+
+    return f"http://127.0.0.1:{args.port}", stop
+
+
+def app_stats(session, url):
+    try:
+        return session.get(f"{url}/", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        return {}
+
+
+def run(args):
+    local = not args.url
+    with tempfile.TemporaryDirectory() as tmp, MediaStub() as media_stub:
+        if local:
+            url, stop_app = start_app(args, tmp, media_stub)
+        else:
+            url, stop_app = args.url.rstrip("/"), None
+        # A remote app can only fetch photos from us if it shares our loopback.
+        media_url = media_stub.url if local or args.photos_from_loopback else None
+
+        session = requests.Session()
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=args.concurrency))
+        tracker = TurnTracker() if local else None
+        if tracker:
+            tracker.start()
+
+        schedule = build_schedule(args, media_url)
+        before = app_stats(session, url)
+        results = []  # (kind, status or exception name, latency seconds)
+        results_lock = threading.Lock()
+
+        def send(kind, data, scheduled):
+            try:
+                if kind == "trigger":
+                    response = session.post(f"{url}/trigger-agent", params=data, timeout=args.timeout)
+                else:
+                    if tracker:
+                        tracker.expect(data["MessageSid"], scheduled)
+                    response = session.post(f"{url}/whatsapp-webhook", data=data, timeout=args.timeout)
+                outcome = response.status_code
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+            with results_lock:
+                results.append((kind, outcome, time.perf_counter() - scheduled))
+
+        print(f"🚀 {len(schedule)} requests from {args.senders} senders at {args.rate}/s against {url}")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="load") as executor:
+            for offset, kind, data in schedule:
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, kind, data, start + offset)
+        send_seconds = time.perf_counter() - start
+
+        if tracker:
+            deadline = time.perf_counter() + args.drain
+            while tracker.pending() and time.perf_counter() < deadline:
+                time.sleep(POLL_INTERVAL)
+            tracker.stop()
+        elapsed = time.perf_counter() - start
+        after = app_stats(session, url)
+
+        if stop_app:
+            stop_app()
+
+    return report(args, results, tracker, send_seconds, elapsed, before, after)
+
+
+def report(args, results, tracker, send_seconds, elapsed, before, after):
+    acks = {}
+    errors = {}
+    for kind, outcome, latency in results:
+        if outcome == 200:
+            acks.setdefault("trigger" if kind == "trigger" else "webhook", []).append(latency)
+        else:
+            errors[str(outcome)] = errors.get(str(outcome), 0) + 1
+
+    db_before, db_after = before.get("db", {}), after.get("db", {})
+    result = {
+        "config": vars(args),
+        "requests": len(results),
+        "send_seconds": round(send_seconds, 2),
+        "throughput_rps": round(len(results) / send_seconds, 2) if send_seconds else 0,
+        "acks": {endpoint: summarize(values) for endpoint, values in acks.items()},
+        "by_kind": {kind: sum(1 for k, _, _ in results if k == kind) for kind in ("message", "photo", "trigger")},
+        "errors": errors,
+        "error_rate": round(sum(errors.values()) / len(results), 4) if results else 0,
+        "sqlite": {key: round(db_after[key] - db_before.get(key, 0), 3) for key in db_after},
+        "queue": after.get("queue", {}),
+    }
+    if tracker:
+        turns = list(tracker.finished.values())
+        result["turns"] = dict(summarize(turns), unfinished=len(tracker.pending()))
+        result["turns_per_second"] = round(len(turns) / elapsed, 2) if elapsed else 0
+
+    print(f"📈 Sent {result['requests']} in {result['send_seconds']}s ({result['throughput_rps']} req/s)")
+    for endpoint, stats in result["acks"].items():
+        print(f"  {endpoint:8s} ack  p50 {stats['p50_ms']:8.1f}ms  p95 {stats['p95_ms']:8.1f}ms  "
+              f"p99 {stats['p99_ms']:8.1f}ms  (n={stats['n']})")
+    if "turns" in result and result["turns"]["n"]:
+        turns = result["turns"]
+        print(f"  turns         p50 {turns['p50_ms']:8.1f}ms  p95 {turns['p95_ms']:8.1f}ms  "
+              f"p99 {turns['p99_ms']:8.1f}ms  ({result['turns_per_second']} turns/s, {turns['unfinished']} unfinished)")
+    print(f"  errors: {errors or 'none'} ({result['error_rate'] * 100:.2f}%)")
+    if result["sqlite"]:
+        sqlite = result["sqlite"]
+        print(f"  sqlite: {sqlite.get('writes', 0):.0f} writes, {sqlite.get('lock_waits', 0):.0f} lock waits "
+              f"({sqlite.get('lock_wait_seconds', 0)}s), {sqlite.get('lock_retries', 0):.0f} retries")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"✅ Results written to {args.out}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for /whatsapp-webhook and /trigger-agent.")
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=20.0, help="requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of arrivals")
+    parser.add_argument("--photo-ratio", type=float, default=0.2)
+    parser.add_argument("--repeat-photo-ratio", type=float, default=0.3)
+    parser.add_argument("--trigger-ratio", type=float, default=0.05)
+    parser.add_argument("--llm-latency-ms", type=float, default=500.0)
+    parser.add_argument("--fitbit-latency-ms", type=float, default=100.0)
+    parser.add_argument("--concurrency", type=int, default=200, help="max in-flight HTTP requests")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--drain", type=float, default=120.0, help="seconds to wait for queued turns")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="target an already running app instead (no turn latencies)")
+    parser.add_argument("--photos-from-loopback", action="store_true",
+                        help="with --url: the app can reach this machine's 127.0.0.1 "
+                             "(and runs with MEDIA_URL_PREFIX=http://127.0.0.1:)")
+    parser.add_argument("--out")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
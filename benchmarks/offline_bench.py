@@ -0,0 +1,302 @@
+"""
+Offline benchmark suite: no Gemini, no Fitbit account, no network.
+
+Builds the real graph with benchmarks.fakes.ScriptedChatModel in place of
+Gemini and points FitbitClient at a local FitbitStub, then times each stage
+on its own:
+
+  turn        full graph.invoke() turns (router, LLM rounds, tools, checkpoint)
+  tools       every tool in app/brain.py, invoked directly
+  checkpoint  checkpoint save/load as a thread's history grows
+  history     get_historical_summary over seeded daily_logs (1k/100k/1M rows)
+
+Results are written as JSON (default benchmarks/results/<commit>.json) so
+runs can be compared across commits with the `compare` subcommand.
+
+Usage: python -m benchmarks.offline_bench [--stages turn,tools,checkpoint,history]
+                                          [--turns 50] [--repeat 100] [--rows 1000,100000,1000000]
+                                          [--llm-latency-ms 0] [--fitbit-latency-ms 0] [--out path]
+       python -m benchmarks.offline_bench compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app import brain, database, fitbit_client, services
+from benchmarks.fakes import DEFAULT_TURNS, FitbitStub, ScriptedChatModel, load_bundled_foods, onboard_user
+
+STAGES = ("turn", "tools", "checkpoint", "history")
+CHECKPOINT_SIZES = (10, 100, 1000)  # messages in the thread
+CHECKPOINT_SAMPLES = 20
+HISTORY_USERS = 100
+HISTORY_DAYS = 365
+SEED_BATCH = 50000
+
+# Arguments each tool is benchmarked with; reset_profile runs last since it wipes the user.
+TOOL_ARGS = {
+    "get_health_status": {},
+    "get_historical_summary": {"days": 30},
+    "get_fitbit_history": {"days": 30},
+    "lookup_food_calories": {"food_name": "masala dosa"},
+    "log_food": {"food_name": "masala dosa"},
+    "update_profile": {"weight": 72.0, "target_calories": 2000},
+    "reset_profile": {},
+}
+
+
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"n": 0}
+
+    def pct(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000, 3)
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_turns(graph, llm, turns):
+    config = onboard_user("bench-turns")
+    samples, by_message = [], {}
+    calls_before = llm.calls
+    for i in range(turns):
+        text = DEFAULT_TURNS[i % len(DEFAULT_TURNS)]
+        elapsed = timed(graph.invoke, {"messages": [HumanMessage(content=text)]}, config)
+        samples.append(elapsed)
+        by_message.setdefault(text, []).append(elapsed)
+    return {
+        "all": summarize(samples),
+        "by_message": {text: summarize(values) for text, values in by_message.items()},
+        "llm_calls_per_turn": round((llm.calls - calls_before) / max(turns, 1), 2),
+    }
+
+
+def bench_tools(repeat):
+    config = onboard_user("bench-tools")
+    by_name = {t.name: t for t in brain.tools}
+    results = {}
+    for name, args in TOOL_ARGS.items():
+        samples = []
+        for _ in range(repeat):
+            samples.append(timed(by_name[name].invoke, args, config=config))
+            if name == "reset_profile":
+                onboard_user("bench-tools")  # untimed: put the profile back for the next sample
+        results[name] = summarize(samples)
+    missing = set(by_name) - set(TOOL_ARGS)
+    if missing:
+        results["not_benchmarked"] = sorted(missing)
+    return results
+
+
+def bench_checkpoint(graph):
+    """Grows one thread two messages at a time, timing saves and loads at each size."""
+    config = onboard_user("bench-checkpoint")
+    checkpointer = services.checkpointer()
+    count, results = 0, {}
+
+    def append():
+        nonlocal count
+        graph.update_state(config, {"messages": [
+            HumanMessage(content=f"I had {count} grams of rice"),
+            AIMessage(content=f"Logged. You have {2000 - count} kcal left today."),
+        ]}, as_node="chatbot")
+        count += 2
+
+    for size in CHECKPOINT_SIZES:
+        while count < size:
+            append()
+        saves = [timed(append) for _ in range(CHECKPOINT_SAMPLES)]
+        loads = [timed(checkpointer.get_tuple, config) for _ in range(CHECKPOINT_SAMPLES)]
+        row = database.query_one(
+            "SELECT length(checkpoint) FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id DESC LIMIT 1",
+            ("bench-checkpoint",),
+        )
+        results[str(size)] = {
+            "save": summarize(saves),
+            "load": summarize(loads),
+            "checkpoint_bytes": row[0] if row else None,
+        }
+    return results
+
+
+def seed_daily_logs(rows):
+    """Spreads `rows` food logs over HISTORY_USERS users and HISTORY_DAYS days, then rebuilds the rollup."""
+    rng = random.Random(rows)
+    today = date.today()
+    foods = ("idli", "dosa", "rice", "dal", "paneer", "chapati", "banana", "oats")
+
+    def batch(start, end):
+        for i in range(start, end):
+            day = today - timedelta(days=(i // HISTORY_USERS) % HISTORY_DAYS)
+            yield (day.isoformat(), i % HISTORY_USERS + 1, rng.choice(foods), rng.randint(50, 700))
+
+    for start in range(0, rows, SEED_BATCH):
+        with database.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO daily_logs (date, user_id, food_name, calories_in) VALUES (?, ?, ?, ?)",
+                batch(start, min(rows, start + SEED_BATCH)),
+            )
+    database.rebuild_daily_totals()
+
+
+def bench_history(rows_list, repeat, directory):
+    """get_historical_summary against a fresh DB per size (user 1 has rows / HISTORY_USERS logs)."""
+    original_path = database.DB_PATH
+    config = {"configurable": {"thread_id": "1"}}
+    results = {}
+    try:
+        for rows in rows_list:
+            database.DB_PATH = os.path.join(directory, f"history_{rows}.db")
+            database.migrate()
+            seed_seconds = timed(seed_daily_logs, rows)
+
+            tool = [timed(brain.get_historical_summary.invoke, {"days": 30}, config=config) for _ in range(repeat)]
+            # The pre-rollup query, for comparison with the daily_totals path the tool uses.
+            scan = [timed(database.query_one, """
+                SELECT AVG(total) FROM (
+                    SELECT SUM(calories_in) AS total FROM daily_logs
+                    WHERE user_id = 1 AND date >= date('now', 'localtime', '-30 days') GROUP BY date
+                )
+            """) for _ in range(repeat)]
+
+            results[str(rows)] = {
+                "tool": summarize(tool),
+                "daily_logs_scan": summarize(scan),
+                "seed_seconds": round(seed_seconds, 2),
+                "db_bytes": sum(os.path.getsize(database.DB_PATH + suffix) for suffix in ("", "-wal")
+                                if os.path.exists(database.DB_PATH + suffix)),
+            }
+            database.close_connection()
+    finally:
+        database.DB_PATH = original_path
+    return results
+
+
+def git_info():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True).stdout.strip())
+    except OSError:
+        return "unknown", False
+    return sha or "unknown", dirty
+
+
+def run(args):
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        sys.exit(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    sha, dirty = git_info()
+    report = {
+        "commit": sha,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "turns": args.turns, "repeat": args.repeat, "rows": args.rows,
+            "llm_latency_ms": args.llm_latency_ms, "fitbit_latency_ms": args.fitbit_latency_ms,
+        },
+        "stages": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp, FitbitStub(latency=args.fitbit_latency_ms / 1000) as stub:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        fitbit_client.API_BASE = stub.url
+        llm = ScriptedChatModel(latency=args.llm_latency_ms / 1000)
+        services.install("llm", llm)
+        services.db()
+        load_bundled_foods()
+        graph = services.graph()
+
+        for stage in stages:
+            print(f"⏱️  {stage}...")
+            start = time.perf_counter()
+            if stage == "turn":
+                result = bench_turns(graph, llm, args.turns)
+            elif stage == "tools":
+                result = bench_tools(args.repeat)
+            elif stage == "checkpoint":
+                result = bench_checkpoint(graph)
+            else:
+                result = bench_history([int(r) for r in args.rows.split(",")], args.repeat, tmp)
+            result["stage_seconds"] = round(time.perf_counter() - start, 2)
+            report["stages"][stage] = result
+
+        report["fitbit_requests"] = stub.requests
+        services.checkpointer().conn.close()
+        database.close_connection()
+
+    out = args.out or os.path.join("benchmarks", "results", f"{sha}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {out}")
+
+
+def _flatten(node, prefix=""):
+    """Yields (path, value) for every p50/p95 in a report."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in ("p50_ms", "p95_ms"):
+                yield f"{prefix}{key}", value
+            else:
+                yield from _flatten(value, f"{prefix}{key}.")
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    before = dict(_flatten(old["stages"]))
+    print(f"{old['commit']} -> {new['commit']}")
+    for path, value in _flatten(new["stages"]):
+        if path in before and before[path]:
+            change = (value - before[path]) / before[path] * 100
+            print(f"  {path:70s} {before[path]:10.3f} -> {value:10.3f} ms  ({change:+.1f}%)")
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "compare":
+        compare(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description="Offline NutriAgent benchmarks (fake LLM + Fitbit stub).")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--rows", default="1000,100000,1000000")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--fitbit-latency-ms", type=float, default=0.0)
+    parser.add_argument("--out")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
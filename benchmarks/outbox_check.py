@@ -0,0 +1,121 @@
+"""
+End-to-end check of app/outbox.py against the fake Twilio endpoint.
+
+Queues short and long replies for several destinations, lets the sender
+deliver them through a TwilioStub that injects 503s and 429s, then checks
+that everything arrived, in order, split at 1600 characters, with
+per-destination spacing respected. Also prints how long enqueue() takes
+compared to a synchronous send, and checks that TWILIO_* credentials
+given only in a .env file (the README setup) enable the sender.
+
+Usage: python -m benchmarks.outbox_check [destinations] [messages_per_destination]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from app import database, outbox
+from benchmarks.fakes import TwilioStub
+
+TWILIO_LATENCY = 0.15  # seconds, roughly a real Messages API call
+DEST_INTERVAL = 0.2
+TIMEOUT = 120
+
+
+def reply(destination, n):
+    """Every third reply is a long meal plan that needs splitting."""
+    if n % 3 == 2:
+        days = "\n\n".join(f"Day {d}: oats, dal, rice, paneer tikka, salad and fruit ({1800 + d} kcal)." * 6
+                           for d in range(1, 8))
+        return f"[{destination} #{n}] Your weekly plan:\n\n{days}"
+    return f"[{destination} #{n}] Logged. You have {1200 - n * 50} kcal left today."
+
+
+def check_dotenv():
+    """Imports a copy of the app next to a .env holding the credentials, with none in the environment."""
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree(os.path.dirname(os.path.abspath(outbox.__file__)), os.path.join(tmp, "app"),
+                        ignore=shutil.ignore_patterns("__pycache__"))
+        with open(os.path.join(tmp, ".env"), "w", encoding="utf-8") as f:
+            f.write('TWILIO_ACCOUNT_SID="ACdotenv"\nTWILIO_AUTH_TOKEN="token"\n'
+                    'TWILIO_WHATSAPP_FROM="whatsapp:+14155238886"\n')
+        env = {k: v for k, v in os.environ.items() if not k.startswith("TWILIO_")}
+        env["NUTRIAGENT_DB"] = os.path.join(tmp, "dotenv.db")
+        result = subprocess.run(
+            [sys.executable, "-c", "from app import outbox; print(outbox.ENABLED, outbox.ACCOUNT_SID)"],
+            cwd=tmp, env=env, capture_output=True, text=True,
+        )
+    if result.stdout.split()[-2:] != ["True", "ACdotenv"]:
+        return f".env credentials did not enable the outbox: {(result.stdout + result.stderr).strip()[-300:]}"
+    return None
+
+
+def main():
+    destinations = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    per_destination = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            TwilioStub(fail_every=7, throttle_every=11, latency=TWILIO_LATENCY) as twilio:
+        database.DB_PATH = os.path.join(tmp, "outbox.db")
+        database.init_db()
+        outbox.ACCOUNT_SID, outbox.AUTH_TOKEN = "ACfake", "fake-token"
+        outbox.FROM_NUMBER, outbox.API_BASE = "whatsapp:+14155238886", twilio.url
+        outbox.DEST_INTERVAL, outbox.RETRY_BACKOFF = DEST_INTERVAL, 0.1
+
+        expected = {}
+        enqueue_seconds = []
+        for n in range(per_destination):
+            for d in range(destinations):
+                destination = f"whatsapp:+1555{d:07d}"
+                text = reply(destination, n)
+                expected.setdefault(destination, []).extend(outbox.split_message(text))
+                start = time.perf_counter()
+                outbox.enqueue(destination, text, source=f"SM{d}-{n}")
+                enqueue_seconds.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        outbox.sender.start()
+        while time.perf_counter() - start < TIMEOUT:
+            rows = dict(database.query_all("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+            if not rows.get("queued") and not rows.get("sending"):
+                break
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - start
+        stats = outbox.sender.stats()
+        outbox.sender.stop()
+
+    failures = []
+    dotenv_failure = check_dotenv()
+    if dotenv_failure:
+        failures.append(dotenv_failure)
+    delivered = {}
+    for at, to, body in twilio.messages:
+        delivered.setdefault(to, []).append((at, body))
+    for destination, parts in expected.items():
+        got = delivered.get(destination, [])
+        if [body for _, body in got] != parts:
+            failures.append(f"{destination}: {len(got)}/{len(parts)} parts, or out of order")
+        gaps = [b[0] - a[0] for a, b in zip(got, got[1:])]
+        if gaps and min(gaps) < DEST_INTERVAL * 0.9:
+            failures.append(f"{destination}: sends {min(gaps):.2f}s apart, limit is {DEST_INTERVAL}s")
+    if any(len(body) > outbox.MAX_BODY for _, _, body in twilio.messages):
+        failures.append("a part exceeded 1600 characters")
+
+    total_parts = sum(len(parts) for parts in expected.values())
+    mean_enqueue = sum(enqueue_seconds) / len(enqueue_seconds)
+    print(f"📤 {len(enqueue_seconds)} replies -> {total_parts} parts for {destinations} destinations")
+    print(f"  delivered {len(twilio.messages)} in {elapsed:.1f}s ({len(twilio.messages) / elapsed:.1f}/s)")
+    print(f"  retries {stats['retried']}, failed {stats['failed']}, rows {stats['rows']}")
+    print(f"  enqueue() {mean_enqueue * 1000:.2f}ms per reply vs ~{TWILIO_LATENCY * 1000:.0f}ms+ per part sent inline")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ All parts delivered in order, within the length and rate limits.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import base64
 import requests
 import hashlib
@@ -22,9 +23,11 @@ REDIRECT_URI = "http://localhost:8080"
 #         json.dump(tokens, f, indent=4)
 #     print(f"\n💾 Saved fresh tokens to {TOKEN_FILE}")
 
-def generate_tokens():
+def generate_tokens(sender="1"):
+    """Runs the OAuth flow and stores the tokens on the user identified by `sender` (default: the local user)."""
 
     database.init_db()
+    user_id = database.resolve_user_id(sender)
     if not CLIENT_ID or not CLIENT_SECRET:
         print("❌ Error: Missing CLIENT_ID/SECRET in .env")
         return
@@ -72,10 +75,11 @@ def generate_tokens():
     if response.status_code == 200:
         tokens=response.json()
         expires_at = time.time() + tokens["expires_in"]
-        database.update_token(tokens["access_token"],tokens["refresh_token"], expires_at)
+        database.update_token(tokens["access_token"],tokens["refresh_token"], expires_at, user_id)
         print("SUCCESS! Tokens saved to the Database. ")
     else:
         print(f"❌ Failed: {response.text}")
 
 if __name__ == "__main__":
-    generate_tokens()
\ No newline at end of file
+    # Optional: python get_tokens.py "whatsapp:+91..." to link another user's Fitbit.
+    generate_tokens(sys.argv[1] if len(sys.argv) > 1 else "1")
\ No newline at end of file
@@ -1,28 +1,127 @@
+import os
 import time
+import random
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+from app import database
 
 # The "Trigger" URL
-AGENT_URL = "http://127.0.0.1:8000/trigger-agent"
+AGENT_URL = os.getenv("AGENT_URL", "http://127.0.0.1:8000/trigger-agent")
+
+# Every active user is checked once per interval (30 minutes). Check times
+# are spread across the interval so the API never sees a burst.
+CHECK_INTERVAL = int(os.getenv("SCHEDULER_INTERVAL", 1800))
+JITTER = 0.1  # +/- fraction of the interval added to each user's next run
+TICK = int(os.getenv("SCHEDULER_TICK", 15))  # how often we look for due users
+BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", 500))
+MAX_WORKERS = int(os.getenv("SCHEDULER_WORKERS", 8))
+
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+
+
+def schedule_new_users(now):
+    """Gives every active WhatsApp user without a schedule a random first slot within the interval."""
+    rows = database.query_all("""
+        SELECT u.id FROM users u LEFT JOIN scheduler_state s ON s.user_id = u.id
+        WHERE u.active = 1 AND u.sender LIKE ? AND s.user_id IS NULL
+    """, (database.WHATSAPP_PREFIX + "%",))
+    if rows:
+        with database.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO scheduler_state (user_id, next_run) VALUES (?, ?)",
+                [(row[0], now + random.uniform(0, CHECK_INTERVAL)) for row in rows],
+            )
+    return len(rows)
 
-# Run every 30 minutes (1800 seconds)
-# FOR TESTING: We will set this to 10 seconds so you can see it work NOW.
-# scheduler.py
-CHECK_INTERVAL = 1800  # 30 Minutes 
 
-print(f"[*] Coach Scheduler Started. Poking agent every {CHECK_INTERVAL} seconds...")
+def due_users(now, limit=BATCH_SIZE):
+    return database.query_all("""
+        SELECT s.user_id, u.sender, s.next_run FROM scheduler_state s JOIN users u ON u.id = s.user_id
+        WHERE s.next_run <= ? AND u.active = 1 AND u.sender LIKE ?
+        ORDER BY s.next_run LIMIT ?
+    """, (now, database.WHATSAPP_PREFIX + "%", limit))
 
-while True:
+
+def next_run_after(scheduled, now):
+    """Keeps each user on their own slot; if we fell far behind (e.g. downtime), re-spread from now."""
+    jitter = random.uniform(-JITTER, JITTER) * CHECK_INTERVAL
+    next_run = scheduled + CHECK_INTERVAL + jitter
+    if next_run <= now:
+        next_run = now + random.uniform(0, CHECK_INTERVAL)
+    return next_run
+
+
+def check_user(sender):
+    """Pokes the agent for one user. Returns (ok, latency_seconds)."""
+    start = time.perf_counter()
     try:
-        current_time = datetime.now().strftime('%H:%M')
-        print(f"[*] ({current_time}) Poking Agent...")
-        
-        # This sends a "Wake Up" signal to the brain
-        # The Brain will check Fitbit, check your Goal, and decide if it needs to text you.
-        response = requests.post(AGENT_URL)
-        
-        print(f"    Agent Decision: {response.json().get('final_decision')}")
+        response = session.post(AGENT_URL, params={"sender": sender}, timeout=30)
+        ok = response.status_code == 200 and response.json().get("status") == "Agent Triggered"
     except Exception as e:
-        print(f"    Error: {e}")
-        
-    time.sleep(CHECK_INTERVAL)
\ No newline at end of file
+        print(f"    Error for {sender}: {e}")
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def run_cycle(executor):
+    """Runs every due check (in batches) and returns stats for the cycle."""
+    now = time.time()
+    start = time.perf_counter()
+    stats = {"new": schedule_new_users(now), "checked": 0, "ok": 0, "failed": 0, "latencies": []}
+
+    while True:
+        batch = due_users(now)
+        if not batch:
+            break
+        results = list(executor.map(lambda row: check_user(row[1]), batch))
+        finished = time.time()
+        with database.transaction() as conn:
+            conn.executemany(
+                "UPDATE scheduler_state SET next_run = ?, last_run = ?, last_status = ? WHERE user_id = ?",
+                [
+                    (next_run_after(row[2], finished), finished, "ok" if ok else "failed", row[0])
+                    for row, (ok, _) in zip(batch, results)
+                ],
+            )
+        for ok, latency in results:
+            stats["checked"] += 1
+            stats["ok" if ok else "failed"] += 1
+            stats["latencies"].append(latency)
+
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+
+def format_stats(stats):
+    latencies = sorted(stats["latencies"])
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    return (
+        f"checked={stats['checked']} ok={stats['ok']} failed={stats['failed']} new={stats['new']} "
+        f"elapsed={stats['elapsed']:.2f}s p95={p95 * 1000:.0f}ms"
+    )
+
+
+def main():
+    database.init_db()
+    print(f"[*] Coach Scheduler Started. Checking every user every {CHECK_INTERVAL} seconds...")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while True:
+            try:
+                stats = run_cycle(executor)
+                if stats["checked"] or stats["new"]:
+                    current_time = datetime.now().strftime('%H:%M')
+                    print(f"[*] ({current_time}) Cycle: {format_stats(stats)}")
+            except Exception as e:
+                print(f"    Error: {e}")
+
+            time.sleep(TICK)
+
+
+if __name__ == "__main__":
+    main()
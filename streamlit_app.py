@@ -1,7 +1,7 @@
 import streamlit as st
-import sqlite3
-from app.brain import app_graph
-from app import database
+from app.brain import message_text
+from app import services
+from app.context_window import SCHEDULER_PREFIX
 
 # Configure the page
 st.set_page_config(page_title="NutriAgent MVP", page_icon="🤖", layout="centered")
@@ -10,34 +10,69 @@ st.caption("Your Autonomous Health Coach (Powered by LangGraph & Fitbit)")
 st.markdown("---")
 
 config = {"configurable": {"thread_id": "1"}}
+REPLY_NODES = {"router", "chatbot"}
+
+# Streamlit reruns this script on every interaction; these are built once per process.
+@st.cache_resource
+def get_graph():
+    return services.graph()
+
+@st.cache_resource
+def get_database():
+    return services.db()
 
 # --- NEW: Dynamic Initial Greeting ---
 def get_initial_greeting():
     """Checks the database to see if the user needs onboarding."""
     try:
-        conn = sqlite3.connect(database.DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT daily_calorie_target FROM users WHERE id = 1")
-        row = cursor.fetchone()
-        conn.close()
+        database = get_database()
+        target = database.get_calorie_target(database.resolve_user_id(config["configurable"]["thread_id"]))
         
         # If a goal exists
-        if row and row[0]:
-            return f"Welcome back! Your daily goal is {row[0]} kcal. What did you eat today, or would you like a status update?"
+        if target:
+            return f"Welcome back! Your daily goal is {target} kcal. What did you eat today, or would you like a status update?"
         # If no goal exists (Onboarding mode)
         else:
             return "Welcome to NutriAgent! I see we haven't set up your profile yet. Please tell me your current weight and your daily calorie goal to get started."
     except Exception:
         return "Welcome! Let's set up your profile. What is your weight and calorie goal?"
 
-# Initialize the Streamlit UI chat history dynamically
-if "messages" not in st.session_state:
-    st.session_state.messages = [
-        {"role": "assistant", "content": get_initial_greeting()}
-    ]
+def load_history():
+    """Chat history comes from the checkpointer, so it matches what the agent remembers."""
+    history = []
+    for message in get_graph().get_state(config).values.get("messages", []):
+        # Tool results, tool-call-only AI turns and scheduler pings aren't part of the conversation as shown.
+        if message.type == "human" and message_text(message).startswith(SCHEDULER_PREFIX):
+            continue
+        if message.type in ("human", "ai") and message_text(message):
+            history.append({"role": "user" if message.type == "human" else "assistant", "content": message_text(message)})
+    return history
+
+def stream_reply(user_input):
+    """Yields reply text as the LLM produces it (stream_mode="messages")."""
+    last_id = None
+    for chunk, metadata in get_graph().stream({"messages": [("user", user_input)]}, config, stream_mode="messages"):
+        if chunk.type not in ("ai", "AIMessageChunk") or metadata.get("langgraph_node") not in REPLY_NODES:
+            continue
+        text = message_text(chunk)
+        if not text:
+            continue
+        # A new message id means a second reply in the same turn (e.g. after a tool call).
+        if last_id is not None and chunk.id != last_id:
+            yield "\n\n"
+        last_id = chunk.id
+        yield text
+
+history = load_history()
+
+# The greeting is only shown for an empty thread, and computed once per session.
+if not history:
+    if "greeting" not in st.session_state:
+        st.session_state.greeting = get_initial_greeting()
+    history = [{"role": "assistant", "content": st.session_state.greeting}]
 
 # Render previous messages in the UI
-for message in st.session_state.messages:
+for message in history:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
@@ -46,32 +81,8 @@ if user_input := st.chat_input("Type your message here..."):
     
     # 1. Display user input
     st.chat_message("user").markdown(user_input)
-    st.session_state.messages.append({"role": "user", "content": user_input})
 
-    # 2. Call the LangGraph Agent
+    # 2. Call the LangGraph Agent, rendering tokens as they arrive. The turn is saved by
+    # the checkpointer, so the next rerun picks it up in load_history().
     with st.chat_message("assistant"):
-        with st.spinner("Processing..."):
-            final_response = ""
-            
-            # Stream the execution from our compiled LangGraph
-            for event in app_graph.stream({"messages": [("user", user_input)]}, config):
-                for value in event.values():
-                    if "messages" in value:
-                        last_message = value["messages"][-1]
-                        
-                        # Handle text extraction robustly
-                        if last_message.type == "ai" and last_message.content:
-                            if isinstance(last_message.content, str):
-                                final_response = last_message.content
-                            elif isinstance(last_message.content, list):
-                                text_blocks = [
-                                    block["text"] for block in last_message.content 
-                                    if isinstance(block, dict) and "text" in block
-                                ]
-                                final_response = "\n".join(text_blocks)
-            
-            # Render the final AI answer
-            st.markdown(final_response)
-            
-    # 3. Save the response to Streamlit's UI state
-    st.session_state.messages.append({"role": "assistant", "content": final_response})
\ No newline at end of file
+        st.write_stream(stream_reply(user_input))